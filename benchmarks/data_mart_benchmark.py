@@ -0,0 +1,280 @@
+# coding=utf-8
+# Benchmark of the full data mart build on synthetic disaster csvs 10, 100 and 1000 times the size of the shipped one.
+# Every stage (date dimension, each dimension, fact table) is timed separately and its rows/sec,
+# query count, peak RSS and elapsed time are written to a JSON report. Giving the report of a previous run
+# with --baseline prints how much slower or faster every stage got.
+# The tables of the target database are dropped and recreated: with --postgres-bin-dir, a throwaway PostgreSQL
+# instance is initialized in a temporary directory and removed afterwards, otherwise the database of
+# DISASTER_DB_CONNECTION_STRING is used. Run it from the root of the repository:
+#     python benchmarks/data_mart_benchmark.py --postgres-bin-dir /usr/lib/postgresql/16/bin --scales 10 100
+import argparse
+import csv
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db_data_formatter
+
+SYNTHETIC_CSV_FILE_NAME = "synthetic_disaster_data.csv"
+CSV_DATE_FORMAT = "%m/%d/%Y %H:%M"
+THROWAWAY_INSTANCE_PORT = 54329
+# Columns sampled together so that the generated events keep consistent category/group/subgroup/type combinations
+EVENT_CLASSIFICATION_INDEXES = (db_data_formatter.EVENT_CATEGORY_INDEX, db_data_formatter.EVENT_GROUP_INDEX,
+                                db_data_formatter.EVENT_SUBGROUP_INDEX, db_data_formatter.EVENT_TYPE_INDEX)
+# Columns sampled independently from their own distribution in the source csv, blank values included
+INDEPENDENT_COLUMN_INDEXES = (db_data_formatter.FATALITIES_INDEX, db_data_formatter.INJURED_INFECTED_INDEX,
+                              db_data_formatter.EVACUATED_INDEX, db_data_formatter.UTILITY_PEOPLE_AFFECTED_INDEX,
+                              db_data_formatter.MAGNITUDE_INDEX)
+COST_COLUMN_INDEXES = (db_data_formatter.ESTIMATED_TOTAL_COST_INDEX, db_data_formatter.NORMALIZED_TOTAL_COST_INDEX,
+                       db_data_formatter.FEDERAL_DFAA_PAYMENTS_INDEX, db_data_formatter.PROVINCIAL_DFAA_PAYMENTS,
+                       db_data_formatter.PROVINCIAL_DEPARTMENT_PAYMENTS_INDEX, db_data_formatter.MUNICIPAL_COSTS_INDEX,
+                       db_data_formatter.OGD_COSTS_INDEX, db_data_formatter.INSURANCE_PAYMENTS_INDEX,
+                       db_data_formatter.NGO_PAYMENTS_INDEX)
+
+
+def read_source_rows(csv_file_location):
+    with open(csv_file_location, "rb") as csv_file:
+        csv_reader = csv.reader(csv_file)
+        header = next(csv_reader)
+        return header, [csv_row for csv_row in csv_reader]
+
+
+def parse_csv_date(value):
+    try:
+        return datetime.strptime(value, CSV_DATE_FORMAT)
+    except ValueError:
+        return None
+
+
+# Multiplies a number of the source csv by a random factor around 1, keeping its format (integer or cents)
+def jitter_number(value, random_generator):
+    try:
+        number = float(value)
+    except ValueError:
+        return value
+    number *= random_generator.lognormvariate(0, 0.25)
+    if "." in value:
+        return "%.2f" % number
+    return str(int(round(number)))
+
+
+# Generates row_count rows statistically similar to the source rows: the event classifications, places, comments
+# and dates are drawn from the source rows with their frequencies, the measures and costs are drawn from
+# their column in the source with a random variation. Every comment is made unique, as in the source
+def generate_synthetic_rows(source_rows, row_count, random_generator):
+    classifications = [tuple([source_row[index] for index in EVENT_CLASSIFICATION_INDEXES]) for source_row in source_rows]
+    places = [source_row[db_data_formatter.PLACE_INDEX] for source_row in source_rows]
+    comments = [source_row[db_data_formatter.COMMENT_INDEX] for source_row in source_rows]
+    start_and_end_dates = [(source_row[db_data_formatter.EVENT_START_DATE_INDEX],
+                            source_row[db_data_formatter.EVENT_END_DATE_INDEX]) for source_row in source_rows]
+    column_values = dict([(index, [source_row[index] for source_row in source_rows])
+                          for index in INDEPENDENT_COLUMN_INDEXES + COST_COLUMN_INDEXES])
+    for row_number in xrange(row_count):
+        synthetic_row = [""] * len(source_rows[0])
+        for index, value in zip(EVENT_CLASSIFICATION_INDEXES, random_generator.choice(classifications)):
+            synthetic_row[index] = value
+        synthetic_row[db_data_formatter.PLACE_INDEX] = random_generator.choice(places)
+        synthetic_row[db_data_formatter.COMMENT_INDEX] = "%s Synthetic event %d." % (
+            random_generator.choice(comments), row_number)
+        start_date_value, end_date_value = random_generator.choice(start_and_end_dates)
+        start_date, end_date = parse_csv_date(start_date_value), parse_csv_date(end_date_value)
+        if start_date is not None:
+            # Moves the event by a few days, keeping its duration and its year range
+            shift = timedelta(days=random_generator.randint(-15, 15))
+            start_date_value = (start_date + shift).strftime(CSV_DATE_FORMAT)
+            if end_date is not None:
+                end_date_value = (end_date + shift).strftime(CSV_DATE_FORMAT)
+        synthetic_row[db_data_formatter.EVENT_START_DATE_INDEX] = start_date_value
+        synthetic_row[db_data_formatter.EVENT_END_DATE_INDEX] = end_date_value
+        for index in INDEPENDENT_COLUMN_INDEXES:
+            synthetic_row[index] = random_generator.choice(column_values[index])
+        for index in COST_COLUMN_INDEXES:
+            synthetic_row[index] = jitter_number(random_generator.choice(column_values[index]), random_generator)
+        yield synthetic_row
+
+
+def write_synthetic_csv(csv_file_location, header, source_rows, row_count, seed):
+    with open(csv_file_location, "wb") as csv_file:
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow(header)
+        for synthetic_row in generate_synthetic_rows(source_rows, row_count, random.Random(seed)):
+            csv_writer.writerow(synthetic_row)
+
+
+# Initializes and starts a PostgreSQL instance in data_directory, containing the disaster_db database and schema.
+# Returns its connection string
+def start_throwaway_instance(postgres_bin_dir, data_directory):
+    with open(os.devnull, "wb") as devnull:
+        subprocess.check_call([os.path.join(postgres_bin_dir, "initdb"), "-D", data_directory, "-U", "postgres",
+                               "-A", "trust", "-E", "UTF8"], stdout=devnull)
+        subprocess.check_call([os.path.join(postgres_bin_dir, "pg_ctl"), "-D", data_directory, "-w",
+                               "-l", os.path.join(data_directory, "postgres.log"),
+                               "-o", "-p %d -k %s -h localhost" % (THROWAWAY_INSTANCE_PORT, data_directory),
+                               "start"], stdout=devnull)
+    connection = psycopg2.connect(host="localhost", port=THROWAWAY_INSTANCE_PORT, dbname="postgres", user="postgres")
+    connection.autocommit = True
+    connection.cursor().execute("CREATE DATABASE disaster_db;")
+    connection.close()
+    connection = psycopg2.connect(host="localhost", port=THROWAWAY_INSTANCE_PORT, dbname="disaster_db",
+                                  user="postgres")
+    connection.cursor().execute("CREATE SCHEMA disaster_db_schema;")
+    connection.commit()
+    connection.close()
+    return "host='localhost' port=%d dbname='disaster_db' user='postgres'" % THROWAWAY_INSTANCE_PORT
+
+
+def stop_throwaway_instance(postgres_bin_dir, data_directory):
+    with open(os.devnull, "wb") as devnull:
+        subprocess.call([os.path.join(postgres_bin_dir, "pg_ctl"), "-D", data_directory, "-w", "-m", "fast", "stop"],
+                        stdout=devnull)
+
+
+def count_table_rows(table_name, condition="TRUE"):
+    return db_data_formatter.execute_query("SELECT COUNT(*) FROM disaster_db.disaster_db_schema.%s WHERE %s;" % (
+        table_name, condition))[0][0]
+
+
+# Runs stage_function as a stage of the data mart metrics and returns what it returned along with the measures
+# of the stage. Every scale gets its own metrics
+def measure_stage(stage_name, stage_function):
+    with db_data_formatter.METRICS.stage(stage_name) as stage_metrics:
+        result = stage_function()
+    return result, {
+        "stage": stage_name,
+        "elapsed_seconds": round(stage_metrics["elapsed_seconds"], 4),
+        "database_seconds": round(stage_metrics["database_seconds"], 4),
+        "query_count": stage_metrics["statements"],
+        "round_trips": stage_metrics["round_trips"],
+        "commits": stage_metrics["commits"],
+        # The peak of the whole process so far
+        "peak_rss_kb": stage_metrics["peak_rss_kb"]
+    }
+
+
+def set_stage_rows(stage_measures, row_count):
+    stage_measures["rows"] = row_count
+    stage_measures["rows_per_second"] = round(row_count / max(stage_measures["elapsed_seconds"], 0.0001), 1)
+    return stage_measures
+
+
+# Builds the data mart from csv_file_location one stage at a time, returns the measures of every stage
+def run_stages(csv_file_location):
+    db_data_formatter.METRICS = db_data_formatter.PipelineMetrics()
+    stages = []
+    disaster_records, stage_measures = measure_stage(
+        "read source", lambda: db_data_formatter.read_disaster_records(csv_file_location))
+    stages.append(set_stage_rows(stage_measures, len(disaster_records)))
+
+    first_date, last_date = db_data_formatter.get_source_date_range(
+        db_data_formatter.get_record_date_strings(disaster_records))
+    _, stage_measures = measure_stage("date dimension", lambda: db_data_formatter.create_populate_date_dimension(
+        first_date, last_date))
+    stages.append(set_stage_rows(stage_measures, count_table_rows("date_dimension")))
+
+    db_data_formatter.write_problematic_places(disaster_records)
+    tuple_to_id_maps = {}
+    for dimension_name, create_dimension, member_tuple_attribute in (
+            ("summary", db_data_formatter.create_summary_dimension, "summary_tuple"),
+            ("disaster", db_data_formatter.create_disaster_dimension, "disaster_tuple"),
+            ("cost", db_data_formatter.create_cost_dimension, "cost_tuple"),
+            ("location", db_data_formatter.create_location_dimension, "city_province_country_tuple")):
+        member_tuples = [getattr(disaster_record, member_tuple_attribute) for disaster_record in disaster_records]
+
+        def build_dimension():
+            create_dimension()
+            return db_data_formatter.DIMENSION_POPULATE_FUNCTIONS[dimension_name](member_tuples)
+
+        tuple_to_id_maps[dimension_name], stage_measures = measure_stage(dimension_name + " dimension",
+                                                                         build_dimension)
+        stages.append(set_stage_rows(stage_measures, count_table_rows(dimension_name + "_dimension")))
+
+    _, stage_measures = measure_stage("fact table", lambda: db_data_formatter.create_populate_fact_table(
+        disaster_records, tuple_to_id_maps["location"], tuple_to_id_maps["cost"], tuple_to_id_maps["disaster"],
+        tuple_to_id_maps["summary"]))
+    stages.append(set_stage_rows(stage_measures, count_table_rows("fact")))
+    return stages
+
+
+# Prints the elapsed time of every stage next to the one of the same stage and scale in the baseline report
+def print_comparison(scale_reports, baseline_report):
+    baseline_stages = {}
+    for scale_report in baseline_report["scales"]:
+        for stage_measures in scale_report["stages"]:
+            baseline_stages[(scale_report["scale"], stage_measures["stage"])] = stage_measures
+    for scale_report in scale_reports:
+        for stage_measures in scale_report["stages"]:
+            baseline_stage_measures = baseline_stages.get((scale_report["scale"], stage_measures["stage"]))
+            if baseline_stage_measures is None:
+                continue
+            ratio = stage_measures["elapsed_seconds"] / max(baseline_stage_measures["elapsed_seconds"], 0.0001)
+            print "x%-5d %-20s %9.3fs (baseline %9.3fs, x%.2f)%s" % (
+                scale_report["scale"], stage_measures["stage"], stage_measures["elapsed_seconds"],
+                baseline_stage_measures["elapsed_seconds"], ratio, " SLOWER" if ratio > 1.2 else "")
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Benchmarks every stage of the data mart build on "
+                                                          "synthetic csvs scaled from " +
+                                                          db_data_formatter.CSV_FILE_LOCATION)
+    argument_parser.add_argument("--scales", type=int, nargs="+", default=[10, 100, 1000],
+                                 help="sizes of the synthetic csvs, as multiples of the source csv row count")
+    argument_parser.add_argument("--seed", type=int, default=4142, help="seed of the synthetic data generator")
+    argument_parser.add_argument("--postgres-bin-dir",
+                                 help="directory of initdb and pg_ctl, used to run the benchmark on a throwaway "
+                                      "PostgreSQL instance instead of the configured database")
+    argument_parser.add_argument("--output", default="data_mart_benchmark.json", help="JSON report written")
+    argument_parser.add_argument("--baseline", help="JSON report of a previous run to compare the stages with")
+    arguments = argument_parser.parse_args()
+
+    header, source_rows = read_source_rows(db_data_formatter.CSV_FILE_LOCATION)
+    working_directory = tempfile.mkdtemp(prefix="data_mart_benchmark")
+    data_directory = os.path.join(working_directory, "postgres")
+    db_data_formatter.PROBLEMATIC_ROW_FILE_LOCATION = os.path.join(working_directory, "problematic_rows.csv")
+    db_data_formatter.PROBLEMATIC_PLACES_FILE_LOCATION = os.path.join(working_directory, "problematic_places.csv")
+    scale_reports = []
+    try:
+        if arguments.postgres_bin_dir is not None:
+            db_data_formatter.CONNECTION_STRING = start_throwaway_instance(arguments.postgres_bin_dir, data_directory)
+        else:
+            print "Using the tables of the configured database, they are dropped and recreated"
+        for scale in arguments.scales:
+            csv_file_location = os.path.join(working_directory, SYNTHETIC_CSV_FILE_NAME)
+            row_count = len(source_rows) * scale
+            write_synthetic_csv(csv_file_location, header, source_rows, row_count, arguments.seed)
+            print "Scale x%d: %d synthetic rows" % (scale, row_count)
+            scale_reports.append({"scale": scale, "source_rows": row_count, "stages": run_stages(csv_file_location)})
+    finally:
+        db_data_formatter.close_connections()
+        if arguments.postgres_bin_dir is not None and os.path.isdir(data_directory):
+            stop_throwaway_instance(arguments.postgres_bin_dir, data_directory)
+        shutil.rmtree(working_directory, ignore_errors=True)
+
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "python_version": sys.version.split()[0],
+        "seed": arguments.seed,
+        "scales": scale_reports
+    }
+    with open(arguments.output, "w") as report_file:
+        json.dump(report, report_file, indent=2, sort_keys=True)
+    for scale_report in scale_reports:
+        for stage_measures in scale_report["stages"]:
+            print "x%-5d %-20s %9.3fs %12.1f rows/sec %8d queries %8d kB peak RSS" % (
+                scale_report["scale"], stage_measures["stage"], stage_measures["elapsed_seconds"],
+                stage_measures["rows_per_second"], stage_measures["query_count"], stage_measures["peak_rss_kb"])
+    if arguments.baseline is not None:
+        with open(arguments.baseline) as baseline_file:
+            print_comparison(scale_reports, json.load(baseline_file))
+    print "Report written to " + arguments.output
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# coding=utf-8
+# Micro-benchmark of the place resolution of the location dimension. Compares the throughput of PlaceResolver,
+# with and without its memo, against the original get_city_province_country_tuple_for_place on the shipped csv.
+# Also checks that both resolve every place of the csv the same way, but for INTENDED_DIFFERENCES, and exits with
+# status 1 if they don't. Run it from the root of the repository: python benchmarks/place_parser_benchmark.py
+import argparse
+import csv
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db_data_formatter import CSV_FILE_LOCATION, PLACE_INDEX, PLACE_CACHE_SIZE, TO_PROVINCE_CODE_CONVERSION_MAP, \
+    RECOGNIZED_COUNTRIES, MAIN_CITY_FOR_PROVINCES, PlaceResolver
+
+# Places of the csv PlaceResolver resolves differently than the legacy function, with the tuple it resolves them to
+INTENDED_DIFFERENCES = {
+    # Lists of provinces: the legacy function kept the label coming last in the iteration order of the dictionary,
+    # the resolver keeps the last label of the place
+    "Alberta and Saskatchewan": ("alberta and", "SK", "CANADA"),
+    "Alberta, Saskatchewan, Manitoba and Ontario": ("alberta saskatchewan manitoba and", "ON", "CANADA"),
+    "Kicking Horse Pass, Alberta - British Columbia border": ("kicking horse pass alberta -", "BC", "CANADA"),
+    "Manitoba and Saskatchewan": ("manitoba and", "SK", "CANADA"),
+    "New Brunswick and Eastern Quebec": ("new brunswick and eastern", "QC", "CANADA"),
+    "New Brunswick and Nova Scotia": ("new brunswick and", "NS", "CANADA"),
+    "New Brunswick and Quebec": ("new brunswick and", "QC", "CANADA"),
+    "Newfoundland, Prince Edward Island and Nova Scotia": ("newfoundland prince edward island and", "NS", "CANADA"),
+    "North Saskatchewan River AB and SK": ("north saskatchewan river ab and", "SK", "CANADA"),
+    "Nova Scotia and Prince Edward Island": ("nova scotia and", "PE", "CANADA"),
+    "Quebec and Ontario": ("quebec and", "ON", "CANADA"),
+    "Quebec, New Brunswick, Nova Scotia, and Prince Edward Island": ("quebec new brunswick nova scotia and", "PE",
+                                                                     "CANADA"),
+    "Southern Alberta and Saskatchewan": ("southern alberta and", "SK", "CANADA"),
+    "Yukon to Ontario": ("yukon to", "ON", "CANADA"),
+    "Yukon, Northwest Territories and British Columbia": ("yukon northwest territories and", "BC", "CANADA"),
+    # Labels inside words or names: the legacy function matched " pe" in " peninsula" or " perth" and "saskatchewan"
+    # in a river name, the resolver only matches whole labels
+    "Crutwell, Dillon, Hatchett Lake, Pelican Narrows, Deschambeault, Wahpeton First Nation, Nordell, Peter Pond SK": (
+        "crutwell dillon hatchett lake pelican narrows deschambeaul..", "SK", "CANADA"),
+    "Huron and Perth counties ON": ("huron and perth counties", "ON", "CANADA"),
+    "Little Saskatchewan First Nation Reserve MB": ("little saskatchewan first nation reserve", "MB", "CANADA"),
+    "Niagara Peninsula ON": ("niagara peninsula", "ON", "CANADA"),
+    "Red River, Souris River, Assiniboine River and Pembina River MB": (
+        "red river souris river assiniboine river and pembina river", "MB", "CANADA"),
+    "Roseau River First Nation, Sioux Falls, Peguis First Nation, St. Andrews, St. Clements and Selkirk MB": (
+        "roseau river first nation sioux falls peguis first nation ..", "MB", "CANADA")
+}
+
+
+# The implementation of get_city_province_country_tuple_for_place before PlaceResolver, kept as the baseline
+def legacy_get_city_province_country_tuple_for_place(place):
+    # Put everything to lowercase
+    place = place.lower()
+    # Remove all commas
+    place = place.replace(",", "")
+    # Remove all "
+    place = place.replace("\"", "")
+    # Remove all single quotes
+    place = place.replace("'", "")
+    # Remove all \
+    place = place.replace("\\", "")
+    # Remove city (leading with a space)
+    place = place.replace(" city", "")
+    # Remove city (not leading with a space)
+    place = place.replace("city", "")
+    possible_province_labels = TO_PROVINCE_CODE_CONVERSION_MAP.keys()
+    province = None
+    city = None
+    country = None
+    for label in possible_province_labels:
+        province_string_index = place.lower().rfind(label)
+        if province_string_index >= 0:
+            province = TO_PROVINCE_CODE_CONVERSION_MAP[label]
+            city = place[:province_string_index].strip()
+            country = "CANADA"
+            if len(city) > 60:
+                city = city[:58] + ".."
+    if province is None:
+        for recognized_country in RECOGNIZED_COUNTRIES:
+            country_string_index = place.lower().rfind(recognized_country)
+            if country_string_index >= 0:
+                province = RECOGNIZED_COUNTRIES[recognized_country]
+                city = RECOGNIZED_COUNTRIES[recognized_country]
+                country = RECOGNIZED_COUNTRIES[recognized_country]
+
+    if city is None and province is None:
+        return None
+    else:
+        if city is None or city == "":
+            city = MAIN_CITY_FOR_PROVINCES[province]
+        return city, province, country,
+
+
+def read_places(csv_file_location):
+    with open(csv_file_location, "rb") as csv_file:
+        csv_reader = csv.reader(csv_file)
+        # Skip the header
+        next(csv_reader, None)
+        return [csv_row[PLACE_INDEX].decode('utf-8', 'ignore').encode("utf-8") for csv_row in csv_reader]
+
+
+# Returns the number of places resolved per second
+def measure_throughput(resolve, places, repetitions):
+    start_time = time.time()
+    for _ in range(repetitions):
+        for place in places:
+            resolve(place)
+    elapsed_time = max(time.time() - start_time, 0.000001)
+    return len(places) * repetitions / elapsed_time
+
+
+# Returns the (place, legacy tuple, resolver tuple) of the places resolved differently than the legacy function
+# or than INTENDED_DIFFERENCES expects
+def get_unexpected_differences(places, place_resolver):
+    unexpected_places = []
+    for place in sorted(places):
+        legacy_tuple = legacy_get_city_province_country_tuple_for_place(place)
+        resolved_tuple = place_resolver.resolve(place)
+        if resolved_tuple != INTENDED_DIFFERENCES.get(place, legacy_tuple):
+            unexpected_places.append((place, legacy_tuple, resolved_tuple))
+    return unexpected_places
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Benchmarks the place resolution on " + CSV_FILE_LOCATION)
+    argument_parser.add_argument("--repetitions", type=int, default=50,
+                                 help="number of times every place of the csv is resolved")
+    arguments = argument_parser.parse_args()
+    places = read_places(CSV_FILE_LOCATION)
+    print "%d places, %d distinct, %d repetitions" % (len(places), len(set(places)), arguments.repetitions)
+
+    legacy_throughput = measure_throughput(legacy_get_city_province_country_tuple_for_place, places,
+                                           arguments.repetitions)
+    print "legacy function:          %10.0f places/sec" % legacy_throughput
+    place_resolver = PlaceResolver(TO_PROVINCE_CODE_CONVERSION_MAP, RECOGNIZED_COUNTRIES, 0)
+    throughput = measure_throughput(place_resolver.resolve, places, arguments.repetitions)
+    print "resolver without memo:    %10.0f places/sec (x%.1f)" % (throughput, throughput / legacy_throughput)
+    place_resolver = PlaceResolver(TO_PROVINCE_CODE_CONVERSION_MAP, RECOGNIZED_COUNTRIES, PLACE_CACHE_SIZE)
+    throughput = measure_throughput(place_resolver.resolve, places, arguments.repetitions)
+    print "resolver with memo:       %10.0f places/sec (x%.1f), %d hits, %d misses" % (
+        throughput, throughput / legacy_throughput, place_resolver.cache.hits, place_resolver.cache.misses)
+
+    unexpected_places = get_unexpected_differences(set(places), place_resolver)
+    print "%d distinct places resolved differently than the legacy function, %d of them unexpectedly" % (
+        len([place for place in set(places) if place in INTENDED_DIFFERENCES]) + len(unexpected_places),
+        len(unexpected_places))
+    for place, legacy_tuple, resolved_tuple in unexpected_places:
+        print "    %r: legacy %r, resolver %r" % (place, legacy_tuple, resolved_tuple)
+    return 1 if unexpected_places else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
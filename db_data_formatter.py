@@ -1,20 +1,128 @@
 # coding=utf-8
 import csv
+import re
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
 import sys
+import os
 import json
-from datetime import date
+import calendar
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from collections import OrderedDict
+from contextlib import contextmanager
 import holidays
 import traceback
+import time
+import argparse
+import hashlib
+import struct
+import multiprocessing
+import threading
+import Queue
+import sqlite3
+import tempfile
+import shutil
+import itertools
+from cStringIO import StringIO
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the peak memory isn't measured there
+    resource = None
 
 LOGGING_TURNED_ON = False
-CONNECTION_STRING = "host='localhost' dbname='disaster_db' user='postgres' password='password'"
-NORTH_AMERICAN_HOLIDAYS = holidays.UnitedStates() + holidays.Canada() + holidays.Mexico()
+# The connection settings can be overridden with the DISASTER_DB_CONNECTION_STRING environment variable,
+# settings missing from the string are read by libpq from the usual PGHOST, PGPORT, PGUSER... variables
+CONNECTION_STRING = os.environ.get("DISASTER_DB_CONNECTION_STRING",
+                                   "host='localhost' dbname='disaster_db' user='postgres' password='password'")
+# Bounds of the pool the connections of the process are taken from. Nothing is opened before the first query
+CONNECTION_POOL_MIN_SIZE = int(os.environ.get("DISASTER_DB_CONNECTION_POOL_MIN_SIZE", 1))
+CONNECTION_POOL_MAX_SIZE = int(os.environ.get("DISASTER_DB_CONNECTION_POOL_MAX_SIZE", 4))
 CSV_FILE_LOCATION = "canadian_disaster_database_source_data.csv"
 PROBLEMATIC_ROW_FILE_LOCATION = "problematic_rows.csv"
 PROBLEMATIC_PLACES_FILE_LOCATION = "problematic_places.csv"
-CONNECTION = psycopg2.connect(CONNECTION_STRING)
+# Statistics Canada population estimates, by province and year and by census metropolitan area and year
+PROVINCE_POPULATION_CSV_FILE_LOCATION = "Population_canada_1971_2017.csv"
+CITY_POPULATION_CSV_FILE_LOCATION = "Population_ville_2014_2017.csv"
+# When turned on, fact rows are streamed into the fact table with COPY FROM STDIN in batches
+# instead of being sent one INSERT (and one commit) at a time
+BULK_FACT_LOAD_TURNED_ON = True
+FACT_COPY_BATCH_SIZE = 1000
+# When turned on, the fact table is partitioned on start_date_key, by ranges of FACT_PARTITION_YEARS years
+FACT_PARTITIONING_TURNED_ON = False
+FACT_PARTITION_YEARS = 10
+# When turned on, the dimension keys are 64 bit hashes of the natural attributes of their members instead of
+# SERIAL values, computed in python
+HASH_SURROGATE_KEYS_TURNED_ON = False
+# Number of new dimension members sent in each multi-row INSERT statement
+DIMENSION_INSERT_BATCH_SIZE = 1000
+# The streaming load reads and loads the source STREAMING_CHUNK_SIZE rows at a time. Its dimension key maps keep
+# at most half of STREAMING_MEMORY_LIMIT_MB in memory, counting about KEY_MAP_ENTRY_BYTES per entry, and move
+# the rest to disk. All of them are also moved to disk whenever the process goes over the limit
+STREAMING_CHUNK_SIZE = 10000
+STREAMING_MEMORY_LIMIT_MB = 256
+KEY_MAP_ENTRY_BYTES = 120
+# The pipelined load reads and normalizes the chunks of the streaming load in a reader thread while the previous
+# chunks are loaded, at most PIPELINE_QUEUE_SIZE chunks wait between them
+PIPELINE_QUEUE_SIZE = 4
+PIPELINE_QUEUE_POLL_SECONDS = 0.1
+# Number of statements a QueryBatch groups in a single transaction before committing
+COMMIT_EVERY_STATEMENTS = 500
+# Number of distinct raw place strings whose resolved location is memoized
+PLACE_CACHE_SIZE = 4096
+# How the keywords found in a comment are ordered before the first three are kept in the summary dimension,
+# either "position" (first occurrence in the comment) or "frequency" (most occurrences first)
+SUMMARY_KEYWORD_RANKING = "position"
+# Created on first use by get_connection_pool and get_connection
+CONNECTION_POOL = None
+CONNECTION_POOL_PROCESS_ID = None
+MAIN_CONNECTION_KEY = "main"
+# The shared connection of get_connection and the pool it was taken from
+MAIN_CONNECTION = None
+MAIN_CONNECTION_POOL = None
+# Countries of the holidays of the date dimension, by their holidays library class name
+HOLIDAY_COUNTRIES = ("UnitedStates", "Canada", "Mexico")
+# Canadian provinces whose provincial holidays are added, None keeps the holidays library default (Ontario)
+HOLIDAY_PROVINCES = None
+HOLIDAY_CACHE_DIRECTORY = ".holiday_cache"
+HOLIDAY_TEXT_MAX_LENGTH = 50
+# Built on first use by get_holiday_calendar
+HOLIDAY_CALENDAR = None
+# Metrics of the run written when the data mart is created, the Prometheus text format file is optional
+METRICS_FILE_LOCATION = "etl_metrics.json"
+PROMETHEUS_METRICS_FILE_LOCATION = None
+PROMETHEUS_METRIC_PREFIX = "disaster_etl_"
+SQL_SCRIPTS_DIRECTORY = "sql_scripts"
+ARFF_EXPORT_FILE_LOCATION = "Data.arff"
+PARQUET_EXPORT_FILE_LOCATION = "Data.parquet"
+ARFF_RELATION_NAME = "disaster_data_mart"
+# Number of rows stream_query fetches from its server side cursor at a time
+STREAM_QUERY_ITERSIZE = 2000
+# Number of joined fact rows in each row group of the Parquet export
+EXPORT_BATCH_SIZE = 1000
+DATE_DIMENSION_SCRIPT_FILE_NAME = "create_date_dimension.sql"
+# Secondary indexes built once the data mart is loaded and dropped before loading into it again:
+# (index name, table, indexed columns). The analytic queries filter on the disaster type and group,
+# the province, the country and the year and join the fact table on its foreign keys
+STAR_SCHEMA_INDEXES = (
+    ("fact_start_date_key_brin_idx", "fact", "USING BRIN (start_date_key)"),
+    ("fact_end_date_key_idx", "fact", "(end_date_key)"),
+    ("fact_location_key_idx", "fact", "(location_key)"),
+    ("fact_disaster_key_idx", "fact", "(disaster_key)"),
+    ("fact_summary_key_idx", "fact", "(summary_key)"),
+    ("fact_cost_key_idx", "fact", "(cost_key)"),
+    ("date_dimension_year_actual_idx", "date_dimension", "(year_actual)"),
+    ("disaster_dimension_disaster_type_idx", "disaster_dimension", "(disaster_type)"),
+    ("disaster_dimension_disaster_group_idx", "disaster_dimension", "(disaster_group)"),
+    ("location_dimension_province_idx", "location_dimension", "(province)"),
+    ("location_dimension_country_idx", "location_dimension", "(country)"),
+    ("disaster_aggregate_disaster_type_province_idx", "disaster_aggregate", "(disaster_type, province)"),
+    ("disaster_aggregate_disaster_group_idx", "disaster_aggregate", "(disaster_group)"),
+    ("disaster_aggregate_province_year_idx", "disaster_aggregate", "(province, year_actual)"),
+    ("city_disaster_aggregate_disaster_type_country_idx", "city_disaster_aggregate", "(disaster_type, country)")
+)
 
 # labeling the indexes of the columns of the source disaster csv file
 EVENT_CATEGORY_INDEX = 0
@@ -67,6 +175,22 @@ MAIN_CITY_FOR_PROVINCES = {
     "NT": "yellowknife",
     "NU": "iqaluit"
 }
+# Province abbreviations of the census metropolitan area names of CITY_POPULATION_CSV_FILE_LOCATION
+CITY_POPULATION_PROVINCE_CODES = {
+    "N.L.": "NL",
+    "P.E.I.": "PE",
+    "N.S.": "NS",
+    "N.B.": "NB",
+    "Que.": "QC",
+    "Ont.": "ON",
+    "Man.": "MB",
+    "Sask.": "SK",
+    "Alta.": "AB",
+    "B.C.": "BC",
+    "Y.T.": "YT",
+    "N.W.T.": "NT",
+    "Nvt.": "NU"
+}
 TO_PROVINCE_CODE_CONVERSION_MAP = {
     "newfoundland and labrador": "NL",
     "newfoundland" : "NL",
@@ -123,6 +247,211 @@ SUMMARY_KEYWORD_LIST = [
     "derailed",
     "arson"
 ]
+DATE_DIMENSION_TABLE_NAME = "disaster_db.disaster_db_schema.date_dimension"
+DATE_DIMENSION_COLUMN_NAMES = (
+    "date_key",
+    "date_actual",
+    "epoch",
+    "day_suffix",
+    "day_name",
+    "day_of_week",
+    "day_of_month",
+    "day_of_quarter",
+    "day_of_year",
+    "week_of_month",
+    "week_of_year",
+    "week_of_year_iso",
+    "month_actual",
+    "month_name",
+    "month_name_abbreviated",
+    "quarter_actual",
+    "quarter_name",
+    "year_actual",
+    "first_day_of_week",
+    "last_day_of_week",
+    "first_day_of_month",
+    "last_day_of_month",
+    "first_day_of_quarter",
+    "last_day_of_quarter",
+    "first_day_of_year",
+    "last_day_of_year",
+    "mmyyyy",
+    "mmddyyyy",
+    "weekend_indr",
+    "is_holiday",
+    "holiday_text",
+    "meteorological_season"
+)
+DAY_NAMES = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+MONTH_NAMES = ("January", "February", "March", "April", "May", "June", "July", "August", "September", "October",
+               "November", "December")
+QUARTER_NAMES = ("First", "Second", "Third", "Fourth")
+METEOROLOGICAL_SEASONS = ("Winter", "Winter", "Spring", "Spring", "Spring", "Summer", "Summer", "Summer", "Fall",
+                          "Fall", "Fall", "Winter")
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+FACT_TABLE_NAME = "disaster_db.disaster_db_schema.fact"
+FACT_PARTITION_BOUND_PATTERN = re.compile(r"FOR VALUES FROM \((\d+)\) TO \((\d+)\)")
+LOAD_STATE_TABLE_NAME = "disaster_db.disaster_db_schema.load_state"
+DATA_VERSION_TABLE_NAME = "disaster_db.disaster_db_schema.data_version"
+FACT_COLUMN_NAMES = (
+    "start_date_key",
+    "end_date_key",
+    "location_key",
+    "disaster_key",
+    "summary_key",
+    "cost_key",
+    "fatality_number",
+    "injured_number",
+    "evacuated_number"
+)
+LOAD_STATE_COLUMN_NAMES = (
+    "row_hash",
+    "start_date_key",
+    "end_date_key",
+    "location_key",
+    "disaster_key",
+    "summary_key"
+)
+
+# Returned by LeastRecentlyUsedCache.get for keys that are not cached, since None can be a cached value
+CACHE_MISS = object()
+
+
+# Bounded memo: once max_size entries are cached, the least recently used entry is evicted
+class LeastRecentlyUsedCache(object):
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return CACHE_MISS
+        # Put back the entry as the most recently used one
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if key in self.entries:
+            self.entries.pop(key)
+        elif len(self.entries) >= self.max_size:
+            if self.max_size <= 0:
+                return
+            self.entries.popitem(last=False)
+        self.entries[key] = value
+
+
+# Resolves a place string of the source csv to its (city, province, country) tuple, None if it can't be resolved.
+# Every province label (or country name) is searched in a single pass of one compiled alternation. The place is
+# scanned left to right for whole labels, the longest label winning at each position, and the last label found wins
+# ("ottawa on and hull qc" is in QC, "newfoundland and labrador" is matched as a whole rather than on "labrador").
+# Everything before the province label is the city. Results are memoized on the raw place string
+class PlaceResolver(object):
+    def __init__(self, province_label_to_code_map, recognized_countries, cache_size):
+        self.province_label_to_code_map = province_label_to_code_map
+        self.recognized_countries = recognized_countries
+        self.province_label_pattern = PlaceResolver.compile_labels_pattern(province_label_to_code_map.keys())
+        self.country_pattern = PlaceResolver.compile_labels_pattern(recognized_countries.keys())
+        self.cache = LeastRecentlyUsedCache(cache_size)
+
+    # Longest labels come first so they are preferred by the alternation, and the matches don't overlap so a label
+    # inside a longer one ("labrador" in "newfoundland and labrador") isn't found on its own.
+    # Labels must end on a word boundary so that " pe" doesn't match the start of " perth" or " peninsula"
+    @staticmethod
+    def compile_labels_pattern(labels):
+        sorted_labels = sorted(labels, key=lambda label: (-len(label), label))
+        return re.compile("(%s)\\b" % "|".join([re.escape(label) for label in sorted_labels]))
+
+    # Returns (start index, label) of the last match of the pattern in place, None if there is none
+    @staticmethod
+    def find_last_label(pattern, place):
+        last_match = None
+        for match in pattern.finditer(place):
+            last_match = match
+        if last_match is None:
+            return None
+        return last_match.start(), last_match.group(1)
+
+    def resolve(self, raw_place):
+        city_province_country_tuple = self.cache.get(raw_place)
+        if city_province_country_tuple is CACHE_MISS:
+            city_province_country_tuple = self.parse(raw_place)
+            self.cache.put(raw_place, city_province_country_tuple)
+        return city_province_country_tuple
+
+    def parse(self, raw_place):
+        # Put everything to lowercase and remove all commas, ", single quotes and \
+        place = raw_place.lower().translate(None, ",\"'\\")
+        # Remove city, leading with a space or not
+        place = PLACE_CITY_WORD_PATTERN.sub("", place)
+        province_label_match = PlaceResolver.find_last_label(self.province_label_pattern, place)
+        if province_label_match is not None:
+            province_string_index, label = province_label_match
+            province = self.province_label_to_code_map[label]
+            city = place[:province_string_index].strip()
+            if len(city) > 60:
+                city = city[:58] + ".."
+            if city == "":
+                city = MAIN_CITY_FOR_PROVINCES[province]
+            return city, province, "CANADA",
+        country_match = PlaceResolver.find_last_label(self.country_pattern, place)
+        if country_match is not None:
+            country = self.recognized_countries[country_match[1]]
+            return country, country, country,
+        return None
+
+
+# Finds which keywords of a list appear in texts, as whole words and case insensitively ("dead" doesn't match
+# "deadline"). A text is split into words once and every word sequence is looked up in a map of the keywords,
+# so the cost of an extraction depends on the length of the text and not on the number of keywords.
+# Keywords can be made of several words ("freezing rain")
+class KeywordExtractor(object):
+    WORD_PATTERN = re.compile(r"\w+")
+
+    def __init__(self, keywords):
+        self.words_to_keyword_map = {}
+        self.max_keyword_word_count = 1
+        for keyword in keywords:
+            keyword_words = tuple(KeywordExtractor.WORD_PATTERN.findall(keyword.lower()))
+            if len(keyword_words) == 0:
+                continue
+            self.words_to_keyword_map[keyword_words] = keyword
+            self.max_keyword_word_count = max(self.max_keyword_word_count, len(keyword_words))
+
+    # Returns the keywords found in the text, ranked by "position" (first occurrence first)
+    # or by "frequency" (most occurrences first, ties broken by first occurrence)
+    def extract(self, text, ranking="position"):
+        words = KeywordExtractor.WORD_PATTERN.findall(text.lower())
+        keyword_to_first_position_map = {}
+        keyword_to_occurrence_count_map = {}
+        for position in range(len(words)):
+            for word_count in range(1, min(self.max_keyword_word_count, len(words) - position) + 1):
+                if word_count == 1:
+                    keyword = self.words_to_keyword_map.get((words[position],))
+                else:
+                    keyword = self.words_to_keyword_map.get(tuple(words[position:position + word_count]))
+                if keyword is None:
+                    continue
+                if keyword not in keyword_to_first_position_map:
+                    keyword_to_first_position_map[keyword] = position
+                    keyword_to_occurrence_count_map[keyword] = 0
+                keyword_to_occurrence_count_map[keyword] += 1
+        if ranking == "position":
+            sort_key = lambda keyword: keyword_to_first_position_map[keyword]
+        elif ranking == "frequency":
+            sort_key = lambda keyword: (-keyword_to_occurrence_count_map[keyword], keyword_to_first_position_map[keyword])
+        else:
+            raise ValueError("Unknown keyword ranking %s, expected position or frequency" % ranking)
+        return sorted(keyword_to_first_position_map.keys(), key=sort_key)
+
+    def extract_batch(self, texts, ranking="position"):
+        return [self.extract(text, ranking) for text in texts]
+
 
 # enum containing the color codes for coloring the console output
 class bcolors:
@@ -136,6 +465,11 @@ class bcolors:
     UNDERLINE = '\033[4m'
 
 
+PLACE_CITY_WORD_PATTERN = re.compile(" ?city")
+SUMMARY_KEYWORD_EXTRACTOR = KeywordExtractor(SUMMARY_KEYWORD_LIST)
+PLACE_RESOLVER = PlaceResolver(TO_PROVINCE_CODE_CONVERSION_MAP, RECOGNIZED_COUNTRIES, PLACE_CACHE_SIZE)
+
+
 class MissingDimensionValueException(Exception):
     pass
 
@@ -144,6 +478,599 @@ class DuplicateRowException(Exception):
     pass
 
 
+class HashKeyCollisionException(Exception):
+    pass
+
+
+# Resolves date strings of the source csv (MM/DD/YYYY, optionally followed by a time) to their date_key without
+# querying the database. The date_key is TO_CHAR(datum,'yyyymmdd')::INT as defined in create_date_dimension.sql,
+# so it only has to be checked against the keys that actually exist in the date dimension
+class DateKeyResolver(object):
+    def __init__(self, date_keys):
+        self.date_keys = date_keys
+        self.first_date_key = min(date_keys) if date_keys else None
+        self.last_date_key = max(date_keys) if date_keys else None
+        # Parsed date strings are cached since a lot of events share the same dates
+        self.date_string_to_key_cache = {}
+
+    def get_date_key(self, date_string):
+        date_string = date_string.split(" ")[0]
+        if date_string in self.date_string_to_key_cache:
+            return self.date_string_to_key_cache[date_string]
+        date_key = get_date_key(parse_source_date(date_string))
+        if date_key not in self.date_keys:
+            raise MissingDimensionValueException("Date %s is outside of the date dimension range (%s to %s)" % (
+                date_string, self.first_date_key, self.last_date_key))
+        self.date_string_to_key_cache[date_string] = date_key
+        return date_key
+
+
+# Parses the MM/DD/YYYY date of a source date string, the time that may follow it is ignored
+def parse_source_date(date_string):
+    date_string = date_string.split(" ")[0]
+    try:
+        month, day, year = [int(date_part) for date_part in date_string.split("/")]
+        return date(year, month, day)
+    except ValueError:
+        raise MissingDimensionValueException("Invalid date %s, expected MM/DD/YYYY" % date_string)
+
+
+def get_date_key(day):
+    return day.year * 10000 + day.month * 100 + day.day
+
+
+# Returns the first and last of the valid dates among the source date strings, None and None if none is valid
+def get_source_date_range(date_strings):
+    first_date = last_date = None
+    for date_string in date_strings:
+        try:
+            day = parse_source_date(date_string)
+        except MissingDimensionValueException:
+            continue
+        if first_date is None or day < first_date:
+            first_date = day
+        if last_date is None or day > last_date:
+            last_date = day
+    return first_date, last_date
+
+
+# Holidays of several countries as a flat date_key to holiday text dict, built for a range of years only.
+# Summing the holidays library calendars (UnitedStates() + Canada() + ...) makes every lookup of a new year
+# expand all the countries again and merge all the years expanded so far, instead each country is expanded
+# once for the whole range. The dicts are cached in cache_directory as JSON files keyed by the year range,
+# the countries, the provinces and the version of the holidays library, so later runs don't expand anything
+class HolidayCalendar(object):
+    def __init__(self, countries, provinces=None, cache_directory=None):
+        self.countries = tuple(countries)
+        self.provinces = tuple(provinces) if provinces else None
+        self.cache_directory = cache_directory
+        self.year_range_to_holiday_texts_map = {}
+
+    def get_cache_file_location(self, first_year, last_year):
+        calendar_hash = hashlib.sha1(json.dumps([holidays.__version__, self.countries, self.provinces])).hexdigest()
+        return os.path.join(self.cache_directory, "holidays_%d_%d_%s.json" % (first_year, last_year,
+                                                                               calendar_hash[:12]))
+
+    # Returns the utf-8 text of the holidays of the years from first_year to last_year inclusively, by date_key
+    def get_holiday_texts(self, first_year, last_year):
+        if (first_year, last_year) in self.year_range_to_holiday_texts_map:
+            return self.year_range_to_holiday_texts_map[(first_year, last_year)]
+        cache_file_location = None
+        holiday_texts = None
+        if self.cache_directory is not None:
+            cache_file_location = self.get_cache_file_location(first_year, last_year)
+            if os.path.exists(cache_file_location):
+                with open(cache_file_location, "r") as cache_file:
+                    holiday_texts = dict([(int(date_key), holiday_text.encode("utf-8"))
+                                          for date_key, holiday_text in json.load(cache_file).items()])
+                log("Read holidays from " + cache_file_location)
+        if holiday_texts is None:
+            holiday_texts = self.build_holiday_texts(first_year, last_year)
+            if cache_file_location is not None:
+                if not os.path.isdir(self.cache_directory):
+                    os.makedirs(self.cache_directory)
+                with open(cache_file_location, "w") as cache_file:
+                    json.dump(holiday_texts, cache_file)
+        self.year_range_to_holiday_texts_map[(first_year, last_year)] = holiday_texts
+        return holiday_texts
+
+    def get_country_holidays(self, years):
+        country_holidays = []
+        for country in self.countries:
+            if country == "Canada" and self.provinces is not None:
+                for province in self.provinces:
+                    country_holidays.append(holidays.Canada(years=years, prov=province))
+            else:
+                country_holidays.append(getattr(holidays, country)(years=years))
+        return country_holidays
+
+    def build_holiday_texts(self, first_year, last_year):
+        holiday_names = {}
+        # The names are merged the way the holidays library sums calendars: the last calendar first, then the name
+        # of a date is prefixed with the name of the next calendar unless one of them contains the other
+        for country_holidays in reversed(self.get_country_holidays(range(first_year, last_year + 1))):
+            for holiday_date, holiday_name in country_holidays.items():
+                if isinstance(holiday_name, str):
+                    holiday_name = holiday_name.decode("utf-8")
+                current_name = holiday_names.get(holiday_date)
+                if current_name is None:
+                    holiday_names[holiday_date] = holiday_name
+                elif current_name.find(holiday_name) < 0 and holiday_name.find(current_name) < 0:
+                    holiday_names[holiday_date] = "%s, %s" % (holiday_name, current_name)
+        holiday_texts = {}
+        for holiday_date, holiday_name in holiday_names.items():
+            # holiday_name is truncated on characters, not on utf-8 bytes, to fit in VARCHAR(50)
+            if len(holiday_name) > HOLIDAY_TEXT_MAX_LENGTH:
+                holiday_name = holiday_name[:HOLIDAY_TEXT_MAX_LENGTH - 2] + ".."
+            holiday_texts[get_date_key(holiday_date)] = holiday_name.encode("utf-8")
+        return holiday_texts
+
+
+# Map of dimension member tuples to their key for the streaming load. The tuples aren't kept, only a 12 byte
+# digest of their content: the summary map doesn't hold the comments for example. Up to max_memory_entries
+# entries are kept in a dict, beyond that they are moved to a sqlite database in a temporary file.
+# It supports what the populate and fact functions use of a dict: in, [] and []=
+class HashedKeyMap(object):
+    def __init__(self, max_memory_entries):
+        self.max_memory_entries = max_memory_entries
+        self.memory_map = {}
+        self.spill_file_location = None
+        self.spill_connection = None
+        self.spilled_entry_count = 0
+
+    @staticmethod
+    def get_digest(member_tuple):
+        return hashlib.sha1(repr(member_tuple)).digest()[:12]
+
+    def get_key(self, digest):
+        key = self.memory_map.get(digest)
+        if key is None and self.spill_connection is not None:
+            row = self.spill_connection.execute("SELECT member_key FROM key_map WHERE digest = ?;",
+                                                (buffer(digest),)).fetchone()
+            if row is not None:
+                key = row[0]
+        return key
+
+    def __contains__(self, member_tuple):
+        return self.get_key(HashedKeyMap.get_digest(member_tuple)) is not None
+
+    def __getitem__(self, member_tuple):
+        key = self.get_key(HashedKeyMap.get_digest(member_tuple))
+        if key is None:
+            raise KeyError(member_tuple)
+        return key
+
+    def __setitem__(self, member_tuple, key):
+        self.memory_map[HashedKeyMap.get_digest(member_tuple)] = key
+        if len(self.memory_map) > self.max_memory_entries:
+            self.spill()
+
+    def __len__(self):
+        return len(self.memory_map) + self.spilled_entry_count
+
+    # Moves the entries kept in memory to the sqlite database
+    def spill(self):
+        if len(self.memory_map) == 0:
+            return
+        if self.spill_connection is None:
+            spill_file_descriptor, self.spill_file_location = tempfile.mkstemp(suffix=".sqlite")
+            os.close(spill_file_descriptor)
+            self.spill_connection = sqlite3.connect(self.spill_file_location)
+            self.spill_connection.execute("PRAGMA synchronous = OFF;")
+            self.spill_connection.execute("CREATE TABLE key_map (digest BLOB PRIMARY KEY, member_key INTEGER);")
+        self.spill_connection.executemany("INSERT OR REPLACE INTO key_map VALUES (?, ?);", [
+            (buffer(digest), key) for digest, key in self.memory_map.iteritems()])
+        self.spill_connection.commit()
+        self.spilled_entry_count = self.spill_connection.execute("SELECT COUNT(*) FROM key_map;").fetchone()[0]
+        self.memory_map = {}
+
+    def close(self):
+        if self.spill_connection is not None:
+            self.spill_connection.close()
+            os.remove(self.spill_file_location)
+            self.spill_connection = None
+
+
+# One row of the source csv, normalized once into everything the dimension and fact builders need
+class DisasterRecord(object):
+    __slots__ = (
+        "csv_row",
+        "row_hash",
+        "summary_tuple",
+        "disaster_tuple",
+        "cost_tuple",
+        "city_province_country_tuple",
+        "start_date",
+        "end_date",
+        "fatality_number",
+        "injured_number",
+        "evacuated_number"
+    )
+
+    def __init__(self, csv_row):
+        # The raw row is kept so it can be written as is to the problematic rows file
+        self.csv_row = csv_row
+        # Fingerprint of the row content, used by incremental loads to find the new and amended rows
+        self.row_hash = hashlib.sha1("\x1f".join(csv_row)).hexdigest()
+        # Our csv file is encoded in latin-1 but our database only accepts utf-8 characters
+        decoded_csv_row = [field.decode('utf-8', 'ignore').encode("utf-8") for field in csv_row]
+        self.summary_tuple = get_summary_tuple_for_comment(decoded_csv_row)
+        self.disaster_tuple = get_disaster_tuple(decoded_csv_row)
+        self.cost_tuple = get_cost_tuple(decoded_csv_row)
+        self.city_province_country_tuple = get_city_province_country_tuple_for_place(decoded_csv_row)
+        self.start_date = csv_row[EVENT_START_DATE_INDEX]
+        self.end_date = csv_row[EVENT_END_DATE_INDEX]
+        self.fatality_number = get_measure(csv_row[FATALITIES_INDEX])
+        self.injured_number = get_measure(csv_row[INJURED_INFECTED_INDEX])
+        self.evacuated_number = get_measure(csv_row[EVACUATED_INDEX])
+
+
+# Returns the current resident memory of the process in kilobytes, None where /proc isn't available
+def get_current_rss_kb():
+    try:
+        with open("/proc/self/statm") as statm_file:
+            resident_pages = int(statm_file.read().split()[1])
+    except (IOError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def get_peak_rss_kb():
+    if resource is None:
+        return None
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+# Counts what the pipeline does, in total and per stage. A stage is measured with:
+#     with METRICS.stage("Fact table"):
+# Counts are added to the run totals and to every stage open at that time, stages run more than once are
+# accumulated. The statements and their time are counted by the cursors of InstrumentedConnection
+class PipelineMetrics(object):
+    COUNTER_NAMES = ("statements", "round_trips", "commits", "rows_read", "rows_inserted", "rows_updated",
+                     "rows_deleted", "rows_diverted", "places_diverted")
+    DESCRIPTIONS = {
+        "statements": "Statements sent to the database, a statement executed with many parameter sets counts once per set",
+        "round_trips": "Round-trips to the database, commits and rollbacks included",
+        "commits": "Transactions committed",
+        "rows_read": "Source csv rows read",
+        "rows_inserted": "Rows inserted or upserted in the data mart",
+        "rows_updated": "Rows updated in the data mart",
+        "rows_deleted": "Rows deleted from the data mart",
+        "rows_diverted": "Source rows written to the problematic rows file",
+        "places_diverted": "Places written to the problematic places file",
+        "elapsed_seconds": "Wall clock time",
+        "database_seconds": "Time spent waiting on the database",
+        "python_seconds": "Wall clock time not spent waiting on the database",
+        "peak_rss_kb": "Peak resident memory of the process at the end of the stage, in kilobytes"
+    }
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.totals = PipelineMetrics.new_stage_metrics()
+        self.stages = OrderedDict()
+        # Every thread counts in the stages it opened itself, a pipeline reader thread doesn't count in the stages
+        # the main thread opens while it reads. The lock guards the totals and the stages both threads count in
+        self.thread_state = threading.local()
+        self.lock = threading.Lock()
+
+    # The stages opened by the current thread, innermost last
+    @property
+    def open_stages(self):
+        if not hasattr(self.thread_state, "open_stages"):
+            self.thread_state.open_stages = []
+        return self.thread_state.open_stages
+
+    # Makes the current thread count in stages opened by another thread, a thread started within them for example
+    def join_stages(self, stages_metrics):
+        self.open_stages.extend(stages_metrics)
+
+    @staticmethod
+    def new_stage_metrics():
+        stage_metrics = OrderedDict([(counter_name, 0) for counter_name in PipelineMetrics.COUNTER_NAMES])
+        stage_metrics["elapsed_seconds"] = 0.0
+        stage_metrics["database_seconds"] = 0.0
+        stage_metrics["peak_rss_kb"] = None
+        return stage_metrics
+
+    def count(self, counter_name, amount=1):
+        with self.lock:
+            self.totals[counter_name] += amount
+            for stage_metrics in self.open_stages:
+                stage_metrics[counter_name] += amount
+
+    @contextmanager
+    def stage(self, stage_name):
+        if stage_name not in self.stages:
+            self.stages[stage_name] = PipelineMetrics.new_stage_metrics()
+        stage_metrics = self.stages[stage_name]
+        self.open_stages.append(stage_metrics)
+        stage_start_time = time.time()
+        try:
+            yield stage_metrics
+        finally:
+            self.open_stages.remove(stage_metrics)
+            stage_metrics["elapsed_seconds"] += time.time() - stage_start_time
+            stage_metrics["peak_rss_kb"] = get_peak_rss_kb()
+
+    # Adds the metrics of a stage measured in another process, a dimension worker for example
+    def merge_stage(self, stage_name, other_stage_metrics):
+        if stage_name not in self.stages:
+            self.stages[stage_name] = PipelineMetrics.new_stage_metrics()
+        stage_metrics = self.stages[stage_name]
+        for counter_name in PipelineMetrics.COUNTER_NAMES + ("database_seconds",):
+            self.count(counter_name, other_stage_metrics[counter_name])
+            if stage_metrics not in self.open_stages:
+                stage_metrics[counter_name] += other_stage_metrics[counter_name]
+        stage_metrics["elapsed_seconds"] += other_stage_metrics["elapsed_seconds"]
+        stage_metrics["peak_rss_kb"] = max(stage_metrics["peak_rss_kb"], other_stage_metrics["peak_rss_kb"])
+
+    def get_report(self):
+        totals = OrderedDict(self.totals)
+        totals["elapsed_seconds"] = time.time() - self.start_time
+        totals["peak_rss_kb"] = get_peak_rss_kb()
+        stages = []
+        for stage_name, stage_metrics in [("total", totals)] + self.stages.items():
+            stage_report = OrderedDict([("stage", stage_name)])
+            stage_report.update(stage_metrics)
+            # Worker stages can wait on the database longer than the parent waited on them
+            stage_report["python_seconds"] = max(stage_metrics["elapsed_seconds"] - stage_metrics["database_seconds"],
+                                                 0.0)
+            stages.append(stage_report)
+        return OrderedDict([("started_at", self.start_time), ("stages", stages)])
+
+    def write_json(self, file_location):
+        with open(file_location, "w") as metrics_file:
+            json.dump(self.get_report(), metrics_file, indent=2)
+
+    # Writes the metrics in the Prometheus text exposition format, for the node exporter textfile collector
+    def write_prometheus(self, file_location):
+        stage_reports = self.get_report()["stages"]
+        with open(file_location, "w") as metrics_file:
+            for metric_name in PipelineMetrics.COUNTER_NAMES + ("elapsed_seconds", "database_seconds",
+                                                                 "python_seconds", "peak_rss_kb"):
+                metric_type = "counter" if metric_name in PipelineMetrics.COUNTER_NAMES else "gauge"
+                full_metric_name = PROMETHEUS_METRIC_PREFIX + metric_name + ("_total" if metric_type == "counter" else "")
+                metrics_file.write("# HELP %s %s\n" % (full_metric_name, PipelineMetrics.DESCRIPTIONS[metric_name]))
+                metrics_file.write("# TYPE %s %s\n" % (full_metric_name, metric_type))
+                for stage_report in stage_reports:
+                    if stage_report[metric_name] is None:
+                        continue
+                    stage_label = stage_report["stage"].replace("\\", "\\\\").replace("\"", "\\\"")
+                    metrics_file.write('%s{stage="%s"} %s\n' % (full_metric_name, stage_label,
+                                                                 repr(stage_report[metric_name])))
+
+
+METRICS = PipelineMetrics()
+# Matches the data changing statements, after the savepoint commands a QueryBatch sends along with them
+CHANGED_ROWS_STATEMENT_PATTERN = re.compile(r"\s*(?:(?:RELEASE\s+)?SAVEPOINT\s+\w+;\s*)*(INSERT|UPDATE|DELETE|COPY)\b",
+                                            re.IGNORECASE)
+CHANGED_ROWS_COUNTER_NAMES = {"INSERT": "rows_inserted", "COPY": "rows_inserted", "UPDATE": "rows_updated",
+                              "DELETE": "rows_deleted"}
+
+
+# Counts the statements, round-trips and changed rows of the cursor in METRICS, along with the time spent
+# waiting on the database
+class InstrumentedCursorMixin(object):
+    def execute(self, query, params=None):
+        start_time = time.time()
+        try:
+            return super(InstrumentedCursorMixin, self).execute(query, params)
+        finally:
+            self.count_statements(query, 1, start_time)
+
+    def executemany(self, query, params_list):
+        params_list = list(params_list)
+        start_time = time.time()
+        try:
+            return super(InstrumentedCursorMixin, self).executemany(query, params_list)
+        finally:
+            self.count_statements(query, len(params_list), start_time)
+
+    def copy_expert(self, sql, file_object, size=8192):
+        start_time = time.time()
+        try:
+            return super(InstrumentedCursorMixin, self).copy_expert(sql, file_object, size)
+        finally:
+            self.count_statements(sql, 1, start_time)
+
+    def count_statements(self, query, statement_count, start_time):
+        METRICS.count("database_seconds", time.time() - start_time)
+        METRICS.count("statements", statement_count)
+        METRICS.count("round_trips", statement_count)
+        match = CHANGED_ROWS_STATEMENT_PATTERN.match(query)
+        if match is not None and self.rowcount > 0:
+            METRICS.count(CHANGED_ROWS_COUNTER_NAMES[match.group(1).upper()], self.rowcount)
+
+
+class InstrumentedCursor(InstrumentedCursorMixin, psycopg2.extensions.cursor):
+    pass
+
+
+class InstrumentedDictCursor(InstrumentedCursorMixin, psycopg2.extras.DictCursor):
+    pass
+
+
+# Connection of the pool, its cursors and transactions are counted in METRICS
+class InstrumentedConnection(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        cursor_factory = kwargs.get("cursor_factory", self.cursor_factory)
+        if cursor_factory is psycopg2.extras.DictCursor:
+            kwargs["cursor_factory"] = InstrumentedDictCursor
+        elif cursor_factory is None or cursor_factory is psycopg2.extensions.cursor:
+            kwargs["cursor_factory"] = InstrumentedCursor
+        return super(InstrumentedConnection, self).cursor(*args, **kwargs)
+
+    def commit(self):
+        start_time = time.time()
+        try:
+            return super(InstrumentedConnection, self).commit()
+        finally:
+            METRICS.count("database_seconds", time.time() - start_time)
+            METRICS.count("round_trips")
+            METRICS.count("commits")
+
+    def rollback(self):
+        start_time = time.time()
+        try:
+            return super(InstrumentedConnection, self).rollback()
+        finally:
+            METRICS.count("database_seconds", time.time() - start_time)
+            METRICS.count("round_trips")
+
+
+# Returns the connection pool of the current process, created on first use. A pool inherited from the parent
+# process by a forked worker is never reused, its sockets belong to the parent
+def get_connection_pool():
+    global CONNECTION_POOL, CONNECTION_POOL_PROCESS_ID
+    if CONNECTION_POOL is None or CONNECTION_POOL.closed or CONNECTION_POOL_PROCESS_ID != os.getpid():
+        CONNECTION_POOL = psycopg2.pool.ThreadedConnectionPool(CONNECTION_POOL_MIN_SIZE, CONNECTION_POOL_MAX_SIZE,
+                                                               CONNECTION_STRING,
+                                                               connection_factory=InstrumentedConnection)
+        CONNECTION_POOL_PROCESS_ID = os.getpid()
+    return CONNECTION_POOL
+
+
+def is_connection_healthy(connection):
+    if connection.closed:
+        return False
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT 1;")
+        finally:
+            cursor.close()
+        connection.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+# Takes a connection out of the pool with the given key, replacing it if it is broken
+def acquire_healthy_connection(key=None):
+    connection_pool = get_connection_pool()
+    connection = connection_pool.getconn(key)
+    if not is_connection_healthy(connection):
+        log("Replacing broken connection")
+        connection_pool.putconn(connection, key, close=True)
+        connection = connection_pool.getconn(key)
+    return connection
+
+
+# Returns the connection the stages of the current process share, acquired from the pool on first use
+# and health checked when it is acquired. A connection closed since then is replaced
+def get_connection():
+    global MAIN_CONNECTION, MAIN_CONNECTION_POOL
+    connection_pool = get_connection_pool()
+    if MAIN_CONNECTION_POOL is not connection_pool or MAIN_CONNECTION.closed:
+        if MAIN_CONNECTION_POOL is connection_pool:
+            connection_pool.putconn(MAIN_CONNECTION, MAIN_CONNECTION_KEY, close=True)
+        MAIN_CONNECTION = acquire_healthy_connection(MAIN_CONNECTION_KEY)
+        MAIN_CONNECTION_POOL = connection_pool
+    return MAIN_CONNECTION
+
+
+# Lends a health checked connection of the pool to a stage running in its own thread, for example:
+#     with pooled_connection() as connection:
+#         cursor = connection.cursor()
+# The connection is rolled back and returned to the pool at the end of the with block
+@contextmanager
+def pooled_connection():
+    connection = acquire_healthy_connection()
+    try:
+        yield connection
+    finally:
+        if not connection.closed:
+            connection.rollback()
+        get_connection_pool().putconn(connection)
+
+
+# Closes every connection of the pool of the current process, the next query opens a new pool
+def close_connections():
+    global CONNECTION_POOL
+    if CONNECTION_POOL is not None and not CONNECTION_POOL.closed and CONNECTION_POOL_PROCESS_ID == os.getpid():
+        CONNECTION_POOL.closeall()
+    CONNECTION_POOL = None
+
+
+# Groups parameterized statements in transactions of commit_every statements, on a single cursor.
+# Every statement runs under a savepoint: when a statement fails, only that statement is rolled back
+# and the error is raised to the caller, the rest of the batch is kept. execute_query must not be called
+# while a batch is open since it commits the connection. Use it as a context manager:
+#     with QueryBatch("summary dimension") as query_batch:
+#         query_batch.execute("INSERT ... VALUES (%s, %s) RETURNING ...;", values)
+class QueryBatch(object):
+    def __init__(self, stage_name, commit_every=None):
+        self.stage_name = stage_name
+        self.commit_every = commit_every if commit_every is not None else COMMIT_EVERY_STATEMENTS
+        self.connection = None
+        self.cursor = None
+        self.statements_since_commit = 0
+        self.statement_count = 0
+        self.failed_statement_count = 0
+        self.commit_count = 0
+
+    def __enter__(self):
+        self.connection = get_connection()
+        self.cursor = self.connection.cursor()
+        return self
+
+    def __exit__(self, exception_type, exception_value, exception_traceback):
+        try:
+            if exception_type is None:
+                self.commit()
+            else:
+                self.connection.rollback()
+        finally:
+            self.cursor.close()
+        # The statements and commits are also counted in METRICS, the per batch counts are only logged
+        log("%s: %d statements (%d failed) in %d commits" % (
+            self.stage_name, self.statement_count, self.failed_statement_count, self.commit_count))
+        return False
+
+    # Returns the rows of the statement if it returns any, an empty list otherwise
+    def execute(self, query, params=None):
+        def execute_statement(savepoint_command):
+            self.cursor.execute(savepoint_command + query, params)
+            if self.cursor.description is not None:
+                return self.cursor.fetchall()
+            return []
+        return self.run_statement(execute_statement)
+
+    # Sends all the rows in a single multi-row statement, query has a single VALUES %s placeholder.
+    # With fetch, returns the rows the statement returns, in the order of the rows sent
+    def execute_values(self, query, rows, fetch=False):
+        def execute_statement(savepoint_command):
+            results = psycopg2.extras.execute_values(self.cursor, savepoint_command + query, rows,
+                                                     page_size=max(len(rows), 1), fetch=fetch)
+            return results if fetch else []
+        return self.run_statement(execute_statement)
+
+    def run_statement(self, execute_statement):
+        # The savepoint commands are sent along with the statement so the isolation costs no extra round-trip
+        if self.statements_since_commit == 0:
+            savepoint_command = "SAVEPOINT query_batch_statement;"
+        else:
+            savepoint_command = "RELEASE SAVEPOINT query_batch_statement; SAVEPOINT query_batch_statement;"
+        try:
+            results = execute_statement(savepoint_command)
+        except psycopg2.Error:
+            self.cursor.execute("ROLLBACK TO SAVEPOINT query_batch_statement;")
+            self.failed_statement_count += 1
+            raise
+        self.statement_count += 1
+        self.statements_since_commit += 1
+        if self.statements_since_commit >= self.commit_every:
+            self.commit()
+        return results
+
+    def commit(self):
+        if self.statements_since_commit > 0:
+            self.connection.commit()
+            self.commit_count += 1
+            self.statements_since_commit = 0
+
+
 def log(message):
     if LOGGING_TURNED_ON:
         print message
@@ -163,23 +1090,109 @@ def print_success(success_message):
     print bcolors.ENDC
 
 
-def execute_query(query):
+def execute_query(query, params=None):
     # Configure cursor
-    cursor = CONNECTION.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    connection = get_connection()
+    cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
     results = []
     try:
-        cursor.execute(query)
-        if ("SELECT" in query and "INTO" not in query) or "RETURNING" in query:
+        cursor.execute(query, params)
+        # Only statements returning rows (SELECT, RETURNING...) have a description
+        if cursor.description is not None:
             results = cursor.fetchall()
         log("Query successful")
     except:
         print_stack_trace()
     finally:
         cursor.close()
-        CONNECTION.commit()
+        connection.commit()
         return results
 
 
+# Yields the rows of a query lazily from a server side cursor, itersize rows are fetched per round-trip so only that
+# many are held in memory whatever the size of the result. The rows are plain tuples, DictRows with dict_rows.
+# The cursor lives on its own pooled connection, so commits on the shared connection don't close it, and only sees
+# committed data. Errors are raised, unlike execute_query. For example:
+#     for date_key, in stream_query("SELECT date_key FROM ...;"):
+def stream_query(query, params=None, itersize=None, dict_rows=False):
+    if itersize is None:
+        itersize = STREAM_QUERY_ITERSIZE
+    with pooled_connection() as connection:
+        cursor = connection.cursor("stream_query", cursor_factory=psycopg2.extras.DictCursor if dict_rows else None)
+        try:
+            cursor.execute(query, params)
+            while True:
+                start_time = time.time()
+                rows = cursor.fetchmany(itersize)
+                METRICS.count("database_seconds", time.time() - start_time)
+                METRICS.count("round_trips")
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            cursor.close()
+
+
+# Reads the source csv rows a single time and normalizes each of them into a DisasterRecord.
+# csv_rows can be any iterable of rows (header excluded), including a stream that can't be rewound
+def normalize_disaster_rows(csv_rows):
+    return [DisasterRecord(csv_row) for csv_row in csv_rows]
+
+
+# Yields the records of the source csv chunk_size at a time, only one chunk is in memory at once
+def read_disaster_record_chunks(csv_file_location, chunk_size):
+    with open(csv_file_location, "rb") as csv_file:
+        csv_reader = csv.reader(csv_file)
+        # Skip the header
+        next(csv_reader, None)
+        csv_rows = []
+        for csv_row in csv_reader:
+            csv_rows.append(csv_row)
+            if len(csv_rows) == chunk_size:
+                METRICS.count("rows_read", len(csv_rows))
+                yield normalize_disaster_rows(csv_rows)
+                csv_rows = []
+        if len(csv_rows) > 0:
+            METRICS.count("rows_read", len(csv_rows))
+            yield normalize_disaster_rows(csv_rows)
+
+
+def read_disaster_records(csv_file_location):
+    with open(csv_file_location, "rb") as csv_file:
+        csv_reader = csv.reader(csv_file)
+        # Skip the header
+        next(csv_reader, None)
+        disaster_records = normalize_disaster_rows(csv_reader)
+    METRICS.count("rows_read", len(disaster_records))
+    print_success("Read %d rows from %s" % (len(disaster_records), csv_file_location))
+    return disaster_records
+
+
+def get_record_date_strings(disaster_records):
+    for disaster_record in disaster_records:
+        yield disaster_record.start_date
+        yield disaster_record.end_date
+
+
+# Yields the start and end date strings of the source csv rows without normalizing the rows, for the streaming
+# load which has to size the date dimension before reading the records
+def read_source_date_strings(csv_file_location):
+    with open(csv_file_location, "rb") as csv_file:
+        csv_reader = csv.reader(csv_file)
+        # Skip the header
+        next(csv_reader, None)
+        for csv_row in csv_reader:
+            yield csv_row[EVENT_START_DATE_INDEX]
+            yield csv_row[EVENT_END_DATE_INDEX]
+
+
+def get_measure(measure):
+    if measure == "":
+        return None
+    return measure
+
+
 def execute_scripts_from_file(filename):
     # Open and read the file as a single buffer
     fd = open(filename, "r")
@@ -199,53 +1212,123 @@ def execute_scripts_from_file(filename):
             print_stack_trace()
 
 
-#
-def populate_date_dimension_holidays(holidays_list):
-    # gets all rows in the reported date dimension
-    get_date_dimension_rows_query = """
-        SELECT  date_key,
-                date_actual
+def get_day_suffix(day_of_month):
+    if 11 <= day_of_month <= 13:
+        return "%dth" % day_of_month
+    return "%d%s" % (day_of_month, {1: "st", 2: "nd", 3: "rd"}.get(day_of_month % 10, "th"))
+
+
+# Returns the values of the date dimension attributes that are the same for every day of a month
+def get_date_dimension_month_values(year, month):
+    quarter = (month - 1) // 3 + 1
+    return {
+        "month_columns": "%d\t%-9s\t%s\t%d\t%s" % (month, MONTH_NAMES[month - 1], MONTH_NAMES[month - 1][:3],
+                                                   quarter, QUARTER_NAMES[quarter - 1]),
+        "month_bound_columns": "%04d-%02d-01\t%04d-%02d-%02d\t%04d-%02d-01\t%04d-%02d-%02d" % (
+            year, month, year, month, calendar.monthrange(year, month)[1], year, quarter * 3 - 2,
+            year, quarter * 3, calendar.monthrange(year, quarter * 3)[1]),
+        "first_day_of_quarter_ordinal": date(year, quarter * 3 - 2, 1).toordinal(),
+        "first_day_of_year_ordinal": date(year, 1, 1).toordinal(),
+        "mmyyyy": "%02d%04d" % (month, year),
+        "meteorological_season": METEOROLOGICAL_SEASONS[month - 1]
+    }
+
+
+# Yields the rows of the date dimension from first_date to last_date inclusively as COPY text lines, in the order
+# of DATE_DIMENSION_COLUMN_NAMES. The lines are formatted directly rather than through to_copy_value, and the
+# attributes shared by the days of a month are formatted once per month, the dimension spans tens of thousands
+# of days. The attributes keep the semantics of the PostgreSQL expressions that used to generate them: the names
+# are blank padded to 9 characters like TO_CHAR's 'Day' and 'Month', year_actual, first_day_of_year and
+# last_day_of_year follow the ISO year while week_of_year_iso starts with the calendar year
+def get_date_dimension_copy_lines(first_date, last_date, date_key_to_holiday_text_map):
+    month_values = None
+    for ordinal in range(first_date.toordinal(), last_date.toordinal() + 1):
+        day = date.fromordinal(ordinal)
+        if day.day == 1 or month_values is None:
+            month_values = get_date_dimension_month_values(day.year, day.month)
+        iso_year, iso_week, iso_weekday = day.isocalendar()
+        first_day_of_week = date.fromordinal(ordinal - iso_weekday + 1)
+        last_day_of_week = date.fromordinal(ordinal + 7 - iso_weekday)
+        date_key = get_date_key(day)
+        holiday_text = date_key_to_holiday_text_map.get(date_key)
+        yield "%d\t%04d-%02d-%02d\t%d\t%s\t%-9s\t%d\t%d\t%d\t%d\t%d\t%d\t%04d-W%02d-%d\t%s\t%d\t%04d-%02d-%02d\t" \
+              "%04d-%02d-%02d\t%s\t%04d-01-01\t%04d-12-31\t%s\t%02d%02d%04d\t%s\t%s\t%s\t%s\n" % (
+                  date_key, day.year, day.month, day.day, (ordinal - EPOCH_ORDINAL) * 86400, get_day_suffix(day.day),
+                  DAY_NAMES[iso_weekday - 1], iso_weekday, day.day,
+                  ordinal - month_values["first_day_of_quarter_ordinal"] + 1,
+                  ordinal - month_values["first_day_of_year_ordinal"] + 1, (day.day - 1) // 7 + 1, iso_week,
+                  day.year, iso_week, iso_weekday, month_values["month_columns"], iso_year,
+                  first_day_of_week.year, first_day_of_week.month, first_day_of_week.day,
+                  last_day_of_week.year, last_day_of_week.month, last_day_of_week.day,
+                  month_values["month_bound_columns"], iso_year, iso_year, month_values["mmyyyy"],
+                  day.month, day.day, day.year, "t" if iso_weekday >= 6 else "f",
+                  "f" if holiday_text is None else "t", to_copy_value(holiday_text),
+                  month_values["meteorological_season"])
+
+
+# Copies the dates from first_date to last_date inclusively into the date dimension, holidays included
+def populate_date_dimension(first_date, last_date):
+    date_key_to_holiday_text_map = get_holiday_calendar().get_holiday_texts(first_date.year, last_date.year)
+    copy_lines_into_table(DATE_DIMENSION_TABLE_NAME, DATE_DIMENSION_COLUMN_NAMES,
+                          get_date_dimension_copy_lines(first_date, last_date, date_key_to_holiday_text_map))
+    return (last_date - first_date).days + 1
+
+
+# Returns the set of every date_key present in the date dimension
+def load_date_dimension_keys():
+    return set([row[0] for row in stream_query("""
+        SELECT  date_key
         FROM    disaster_db.disaster_db_schema.date_dimension;
-    """
-    holiday_dates_list = []
-    results = execute_query(get_date_dimension_rows_query)
-    for row in results:
-        date_dimension_id = row[0]
-        is_holiday = row[1] in holidays_list
-        holiday_text = holidays_list.get(row[1])
-        if is_holiday:
-            holiday_text = holiday_text.replace("'", "''")
-            if len(holiday_text) > 50:
-                holiday_text = holiday_text[:48] + ".."
-            holiday_dates_list.append(date_dimension_id)
-            update_query = """
-                UPDATE  disaster_db.disaster_db_schema.date_dimension
-                SET     is_holiday = TRUE,
-                        holiday_text = '%s'
-                WHERE   date_key = '%s';
-            """ % (holiday_text, date_dimension_id)
-            try:
-                execute_query(update_query)
-            except:
-                print_stack_trace()
-                continue
-    print_success('Updated %d dates with holidays out of %d' % (len(holiday_dates_list), len(results)))
+    """)])
+
+
+# The holiday calendar is built on first use only
+def get_holiday_calendar():
+    global HOLIDAY_CALENDAR
+    if HOLIDAY_CALENDAR is None:
+        HOLIDAY_CALENDAR = HolidayCalendar(HOLIDAY_COUNTRIES, HOLIDAY_PROVINCES, HOLIDAY_CACHE_DIRECTORY)
+    return HOLIDAY_CALENDAR
+
+
+# The date dimension covers the dates of the source from first_date to last_date, it is left empty without any
+def create_populate_date_dimension(first_date, last_date):
+    # Execute create_date_dimension_script, it only creates the table
+    execute_scripts_from_file(os.path.join(SQL_SCRIPTS_DIRECTORY, DATE_DIMENSION_SCRIPT_FILE_NAME))
+    if first_date is None:
+        print_success("No valid date in the source, the date dimension is empty")
+        return
+    print_success("Date dimension created and populated with %d dates from %s to %s" % (
+        populate_date_dimension(first_date, last_date), first_date, last_date))
 
 
-def create_populate_date_dimension():
-    # Execute create_date_dimension_script
-    execute_scripts_from_file("sql_scripts/create_date_dimension.sql")
-    # Fill holidays using canadian holiday data
-    populate_date_dimension_holidays(NORTH_AMERICAN_HOLIDAYS)
-    print_success("Date dimension created and populated")
+# Adds the dates from first_date to last_date missing before or after the dates of the date dimension
+def extend_date_dimension(first_date, last_date):
+    if first_date is None:
+        return
+    date_range = execute_query("""
+        SELECT  MIN(date_actual),
+                MAX(date_actual)
+        FROM    disaster_db.disaster_db_schema.date_dimension;
+    """)
+    current_first_date, current_last_date = date_range[0][0], date_range[0][1]
+    added_dates_count = 0
+    if current_first_date is None:
+        added_dates_count += populate_date_dimension(first_date, last_date)
+    else:
+        if first_date < current_first_date:
+            added_dates_count += populate_date_dimension(first_date, current_first_date - timedelta(days=1))
+        if last_date > current_last_date:
+            added_dates_count += populate_date_dimension(current_last_date + timedelta(days=1), last_date)
+    if added_dates_count > 0:
+        print_success("Extended the date dimension with %d dates" % added_dates_count)
 
 
-def create_populate_summary_dimension():
-    create_summary_dimension()
-    return populate_summary_dimension()
+# The keys are SERIAL values, or computed by get_hash_surrogate_key with hash_surrogate_keys
+def get_dimension_key_type(hash_surrogate_keys):
+    return "BIGINT" if hash_surrogate_keys else "SERIAL"
 
 
-def create_summary_dimension():
+def create_summary_dimension(hash_surrogate_keys=False):
     # Create empty summary table
     create_summary_dimension_query = """
         DROP TABLE IF EXISTS disaster_db.disaster_db_schema.fact;
@@ -253,87 +1336,45 @@ def create_summary_dimension():
         
         CREATE TABLE disaster_db.disaster_db_schema.summary_dimension
         (
-          summary_key   SERIAL,
+          summary_key   %s,
           summary       TEXT,
           keyword_1     VARCHAR(20),
           keyword_2     VARCHAR(20),
           keyword_3     VARCHAR(20),
           PRIMARY KEY (summary_key)
         );
-    """
+    """ % get_dimension_key_type(hash_surrogate_keys)
     execute_query(create_summary_dimension_query)
     print_success("Summary dimension created")
 
 
-def populate_summary_dimension():
-    summary_tuple_to_id_map = {}
-    new_rows_count = 0
-    with open(CSV_FILE_LOCATION, "rb") as csv_file:
-        csv_reader = csv.reader(csv_file)
-        # Skip the header
-        next(csv_reader, None)
-        for row in csv_reader:
-            summary_tuple = get_summary_tuple_for_comment(row)
-            if summary_tuple not in summary_tuple_to_id_map:
-                sql_script = """
-                    INSERT INTO disaster_db.disaster_db_schema.summary_dimension(summary, keyword_1, keyword_2, keyword_3)
-                    VALUES (
-                      %s, %s, %s, %s
-                    )
-                    RETURNING summary_key;
-                """ % summary_tuple
-                summary_key = execute_query(sql_script)
-                summary_tuple_to_id_map[summary_tuple] = summary_key[0][0]
-                new_rows_count += 1
-        print_success("Populated summary dimension with %d rows" % new_rows_count)
-    return summary_tuple_to_id_map
+# Only the members missing from summary_tuple_to_id_map are inserted, the map is completed and returned
+def populate_summary_dimension(summary_tuples, summary_tuple_to_id_map=None):
+    return populate_dimension_in_batches("summary", summary_tuples, summary_tuple_to_id_map)
 
 
 def get_summary_tuple_for_comment(row):
     comment = row[COMMENT_INDEX]
-    comment = comment.decode('utf-8','ignore').encode("utf-8")
-    # escape all single quotes
-    comment = comment.replace("'", "''")
     if comment == "" or comment is None:
-        comment = "NULL"
-    else:
-        comment = "'" + comment + "'"
+        comment = None
     matching_keywords_list = []
-    for keyword in SUMMARY_KEYWORD_LIST:
-        if keyword in comment:
-            matching_keywords_list.append(keyword)
-    keyword1 = "NULL"
-    keyword2 = "NULL"
-    keyword3 = "NULL"
+    if comment is not None:
+        matching_keywords_list = SUMMARY_KEYWORD_EXTRACTOR.extract(comment, SUMMARY_KEYWORD_RANKING)
+    keyword1 = None
+    keyword2 = None
+    keyword3 = None
     if len(matching_keywords_list) >= 1:
-        keyword1 = "'" + matching_keywords_list[0] + "'"
+        keyword1 = matching_keywords_list[0]
         if len(matching_keywords_list) >= 2:
-            keyword2 = "'" + matching_keywords_list[1] + "'"
+            keyword2 = matching_keywords_list[1]
             if len(matching_keywords_list) >= 3:
-                keyword3 = "'" + matching_keywords_list[2] + "'"
+                keyword3 = matching_keywords_list[2]
     return comment, keyword1, keyword2, keyword3,
 
 
-def populate_disaster_dimension():
-    disaster_tuple_to_id_map = {}
-    with open(CSV_FILE_LOCATION, "rb") as csv_file:
-        csv_reader = csv.reader(csv_file)
-        # Skip header row
-        next(csv_reader, None)
-        for csv_row in csv_reader:
-            disaster_tuple = get_disaster_tuple(csv_row)
-            if disaster_tuple is not None and disaster_tuple not in disaster_tuple_to_id_map:
-                sql_script = """
-                    INSERT INTO disaster_db.disaster_db_schema.disaster_dimension(disaster_type, disaster_subgroup, disaster_group, disaster_category, magnitude, utility_people_affected)
-                    VALUES (
-                      %s, %s, %s, %s, %s, %s
-                    )
-                    RETURNING disaster_key;
-                """ % disaster_tuple
-                disaster_key = execute_query(sql_script)[0][0]
-                disaster_tuple_to_id_map[disaster_tuple] = disaster_key
-        print_success("Successfully populated disaster dimension")
-    return disaster_tuple_to_id_map
+# Only the members missing from disaster_tuple_to_id_map are inserted, the map is completed and returned
+def populate_disaster_dimension(disaster_tuples, disaster_tuple_to_id_map=None):
+    return populate_dimension_in_batches("disaster", disaster_tuples, disaster_tuple_to_id_map)
 
 
 def get_disaster_tuple(csv_row):
@@ -347,48 +1388,35 @@ def get_disaster_tuple(csv_row):
     # Every row for which disaster_category has a length more than 10 is actually invalid so we can just ignore it
     if len(disaster_category) > 10:
         return None
-    # Our csv file is encoded in latin-1 but our database only accepts utf-8 characters
-    disaster_type = disaster_type.decode('utf-8','ignore').encode("utf-8")
-    disaster_category = disaster_category.decode('utf-8','ignore').encode("utf-8")
-    disaster_group = disaster_group.decode('utf-8','ignore').encode("utf-8")
-    disaster_subgroup = disaster_subgroup.decode('utf-8','ignore').encode("utf-8")
-    magnitude = magnitude.decode('utf-8','ignore').encode("utf-8")
-    utility_people_affected = utility_people_affected.decode('utf-8','ignore').encode("utf-8")
-
     if disaster_type == "":
-        disaster_type = "NULL"
+        disaster_type = None
     else:
-        disaster_type = "'" + disaster_type.lower().replace("'", "") + "'"
+        disaster_type = disaster_type.lower().replace("'", "")
     if disaster_subgroup == "":
-        disaster_subgroup = "NULL"
+        disaster_subgroup = None
     else:
-        disaster_subgroup = "'" + disaster_subgroup.lower().replace("'", "") + "'"
+        disaster_subgroup = disaster_subgroup.lower().replace("'", "")
     if disaster_group == "":
-        disaster_group = "NULL"
+        disaster_group = None
     else:
-        disaster_group = "'" + disaster_group.lower().replace("'", "") + "'"
+        disaster_group = disaster_group.lower().replace("'", "")
     if disaster_category == "":
-        disaster_category = "NULL"
+        disaster_category = None
     else:
-        disaster_category = "'" + disaster_category.lower().replace("'", "") + "'"
+        disaster_category = disaster_category.lower().replace("'", "")
     # Only earthquakes and tsunamis (denoted by the geological disaster_category subgroup)
-    if magnitude == "" or disaster_subgroup.lower() != "'geological'":
-        magnitude = "NULL"
+    if magnitude == "" or disaster_subgroup != "geological":
+        magnitude = None
     else:
-        magnitude = "'" + magnitude.lower().replace("'", "") + "'"
+        magnitude = get_magnitude_value(magnitude)
     if utility_people_affected == "":
-        utility_people_affected = "NULL"
+        utility_people_affected = None
     else:
-        utility_people_affected = "'" + utility_people_affected.lower().replace("'", "") + "'"
+        utility_people_affected = get_number_value(utility_people_affected, int)
     return disaster_type, disaster_subgroup, disaster_group, disaster_category, magnitude, utility_people_affected,
 
 
-def create_populate_disaster_dimension():
-    create_disaster_dimension()
-    return populate_disaster_dimension()
-
-
-def create_disaster_dimension():
+def create_disaster_dimension(hash_surrogate_keys=False):
     # Create empty disaster table
     create_disaster_dimension_query = """
         DROP TABLE IF EXISTS disaster_db.disaster_db_schema.fact;
@@ -396,7 +1424,7 @@ def create_disaster_dimension():
         
         CREATE TABLE disaster_db.disaster_db_schema.disaster_dimension
         (
-          disaster_key              SERIAL,
+          disaster_key              %s,
           disaster_type             VARCHAR(40),
           disaster_subgroup         VARCHAR(30),
           disaster_group            VARCHAR(15),
@@ -405,73 +1433,64 @@ def create_disaster_dimension():
           utility_people_affected   INT,
           PRIMARY KEY (disaster_key)
         );
-    """
+    """ % get_dimension_key_type(hash_surrogate_keys)
     execute_query(create_disaster_dimension_query)
 
 
-def populate_cost_dimension():
-    cost_tuple_to_id_map = {}
-    with open(CSV_FILE_LOCATION, "rb") as csv_file:
-        csv_reader = csv.reader(csv_file)
-        # Skip header row
-        next(csv_reader, None)
-        for csv_row in csv_reader:
-            # Get tuple for the row. Method does some data cleaning at the same time
-            cost_tuple = get_cost_tuple(csv_row)
-            if cost_tuple not in cost_tuple_to_id_map:
-                sql_script = """
-                    INSERT INTO disaster_db.disaster_db_schema.cost_dimension(estimated_total_cost, normalized_total_cost, federal_dfaa_payments, 
-                        provincial_dfaa_payments, provincial_department_payments, municipal_cost, ogd_cost, insurance_payments, ngo_cost)
-                    VALUES (
-                      %s, %s, %s, %s, %s, %s, %s, %s, %s
-                    )
-                    RETURNING cost_key;
-                """ % cost_tuple
-                cost_key = execute_query(sql_script)
-                cost_tuple_to_id_map[cost_tuple] = cost_key[0][0]
-        print_success("Successfully populated cost dimension")
-    return cost_tuple_to_id_map
+# Only the members missing from cost_tuple_to_id_map are inserted, the map is completed and returned
+def populate_cost_dimension(cost_tuples, cost_tuple_to_id_map=None):
+    # The tuples were cleaned when the records were read
+    return populate_dimension_in_batches("cost", cost_tuples, cost_tuple_to_id_map)
 
 
 def get_cost_tuple(csv_row):
-    estimated_total_cost = csv_row[ESTIMATED_TOTAL_COST_INDEX]
-    normalized_total_cost = csv_row[NORMALIZED_TOTAL_COST_INDEX]
-    federal_payments = csv_row[FEDERAL_DFAA_PAYMENTS_INDEX]
-    provincial_dfaa_payments = csv_row[PROVINCIAL_DFAA_PAYMENTS]
-    provincial_department_payments = csv_row[PROVINCIAL_DEPARTMENT_PAYMENTS_INDEX]
-    municipal_cost = csv_row[MUNICIPAL_COSTS_INDEX]
-    ogd_cost = csv_row[OGD_COSTS_INDEX]
-    insurance_payments = csv_row[INSURANCE_PAYMENTS_INDEX]
-    ngo_cost = csv_row[NGO_PAYMENTS_INDEX]
     # Some cleaning for insertion in the db
-    if estimated_total_cost == "":
-        estimated_total_cost = "NULL"
-    if normalized_total_cost == "":
-        normalized_total_cost = "NULL"
-    if federal_payments == "":
-        federal_payments = "NULL"
-    if provincial_dfaa_payments == "":
-        provincial_dfaa_payments = "NULL"
-    if provincial_department_payments == "":
-        provincial_department_payments = "NULL"
-    if municipal_cost == "":
-        municipal_cost = "NULL"
-    if ogd_cost == "":
-        ogd_cost = "NULL"
-    if insurance_payments == "":
-        insurance_payments = "NULL"
-    if ngo_cost == "":
-        ngo_cost = "NULL"
+    estimated_total_cost = get_cost_value(csv_row[ESTIMATED_TOTAL_COST_INDEX])
+    normalized_total_cost = get_cost_value(csv_row[NORMALIZED_TOTAL_COST_INDEX])
+    federal_payments = get_cost_value(csv_row[FEDERAL_DFAA_PAYMENTS_INDEX])
+    provincial_dfaa_payments = get_cost_value(csv_row[PROVINCIAL_DFAA_PAYMENTS])
+    provincial_department_payments = get_cost_value(csv_row[PROVINCIAL_DEPARTMENT_PAYMENTS_INDEX])
+    municipal_cost = get_cost_value(csv_row[MUNICIPAL_COSTS_INDEX])
+    ogd_cost = get_cost_value(csv_row[OGD_COSTS_INDEX])
+    insurance_payments = get_cost_value(csv_row[INSURANCE_PAYMENTS_INDEX])
+    ngo_cost = get_cost_value(csv_row[NGO_PAYMENTS_INDEX])
     return (estimated_total_cost, normalized_total_cost, federal_payments, provincial_dfaa_payments,
             provincial_department_payments, municipal_cost, ogd_cost, insurance_payments, ngo_cost,)
 
 
-def create_populate_cost_dimension():
-    create_cost_dimension()
-    return populate_cost_dimension()
+# Some costs have cents, they are rounded like the database does when storing them as BIGINT so that
+# the tuples read back from the cost dimension are equal to the ones built from the csv
+def get_cost_value(cost):
+    if cost == "":
+        return None
+    cost = get_number_value(cost, Decimal)
+    if isinstance(cost, Decimal):
+        return int(cost.to_integral_value(rounding=ROUND_HALF_UP))
+    return cost
+
+
+# Magnitudes are rounded to the one decimal of the DECIMAL(18, 1) column like the database does when storing them,
+# so that their hash keys and the tuples read back from the disaster dimension match the ones built from the csv
+def get_magnitude_value(magnitude):
+    magnitude = get_number_value(magnitude, Decimal)
+    if isinstance(magnitude, Decimal) and magnitude.is_finite():
+        try:
+            return magnitude.quantize(Decimal("0.1"), rounding=ROUND_HALF_UP)
+        except InvalidOperation:
+            # Too many digits for the column anyway, the database rejects it
+            return magnitude
+    return magnitude
 
 
-def create_cost_dimension():
+# Converts the value with number_type, values that are not numbers are kept as is and will be rejected by the database
+def get_number_value(value, number_type):
+    try:
+        return number_type(value)
+    except (ValueError, InvalidOperation):
+        return value
+
+
+def create_cost_dimension(hash_surrogate_keys=False):
     # Create empty cost table
     create_cost_dimension_query = """
         DROP TABLE IF EXISTS disaster_db.disaster_db_schema.fact;
@@ -479,7 +1498,7 @@ def create_cost_dimension():
         
         CREATE TABLE disaster_db.disaster_db_schema.cost_dimension
         (
-          cost_key                          SERIAL,
+          cost_key                          %s,
           estimated_total_cost              BIGINT,
           normalized_total_cost             BIGINT,
           federal_dfaa_payments             BIGINT,
@@ -491,13 +1510,13 @@ def create_cost_dimension():
           ngo_cost                          BIGINT,
           PRIMARY KEY (cost_key)
         );
-    """
+    """ % get_dimension_key_type(hash_surrogate_keys)
     execute_query(create_cost_dimension_query)
 
 
 # Returns a map that maps every valid place string to its id in the database
 # Only populates rows for canadian locations. Non canadian locations will have to be created some other way
-def create_populate_location_dimension():
+def create_location_dimension(hash_surrogate_keys=False):
     # Create empty location table
     create_location_dimension_query = """
         DROP TABLE IF EXISTS disaster_db.disaster_db_schema.fact;
@@ -505,181 +1524,1378 @@ def create_populate_location_dimension():
         
         CREATE TABLE disaster_db.disaster_db_schema.location_dimension
         (
-            location_key    SERIAL,
+            location_key    %s,
             city            VARCHAR(190),
             province        VARCHAR(50),
             country         VARCHAR(30),
             canada          BOOLEAN,
             PRIMARY KEY (location_key)
         );
-    """
+    """ % get_dimension_key_type(hash_surrogate_keys)
     execute_query(create_location_dimension_query)
-    # Populate location_dimension
-    city_province_tuple_to_id_map = {}
-    with open(CSV_FILE_LOCATION, "rb") as csv_file:
-        csv_reader = csv.reader(csv_file)
-        with open(PROBLEMATIC_PLACES_FILE_LOCATION, "wb") as problematic_places_file:
-            problematic_csv_writer = csv.writer(problematic_places_file)
-            for csv_row in csv_reader:
-                city_province_country_tuple = get_city_province_country_tuple_for_place(csv_row)
-                if city_province_country_tuple not in city_province_tuple_to_id_map and city_province_country_tuple is not None:
-                    is_canada = "TRUE" if city_province_country_tuple[2] == "CANADA" else "FALSE"
-                    location_key = execute_query("""
-                        INSERT INTO disaster_db.disaster_db_schema.location_dimension(city, province, country, canada)
-                        VALUES ('%s', '%s', '%s', %s)
-                        RETURNING location_key;
-                    """ % (city_province_country_tuple[0], city_province_country_tuple[1], city_province_country_tuple[2], is_canada,))
-                    city_province_tuple_to_id_map[city_province_country_tuple] = location_key[0][0]
-                elif city_province_country_tuple is None:
-                    problematic_csv_writer.writerow((csv_row[PLACE_INDEX],))
-                    continue
-    print_success("Location dimension created")
-    return city_province_tuple_to_id_map
+
+
+# Only the locations missing from city_province_tuple_to_id_map are inserted, the map is completed and returned
+def populate_location_dimension(city_province_country_tuples, city_province_tuple_to_id_map=None):
+    return populate_dimension_in_batches("location", city_province_country_tuples, city_province_tuple_to_id_map)
+
+
+# Writes the places that couldn't be resolved to a location
+def write_problematic_places(disaster_records):
+    with open(PROBLEMATIC_PLACES_FILE_LOCATION, "wb") as problematic_places_file:
+        problematic_csv_writer = csv.writer(problematic_places_file)
+        problematic_csv_writer.writerow(("PLACE",))
+        write_problematic_place_rows(problematic_csv_writer, disaster_records)
+
+
+def write_problematic_place_rows(problematic_csv_writer, disaster_records):
+    for disaster_record in disaster_records:
+        if disaster_record.city_province_country_tuple is None:
+            problematic_csv_writer.writerow((disaster_record.csv_row[PLACE_INDEX],))
+            METRICS.count("places_diverted")
 
 
 def get_city_province_country_tuple_for_place(csv_row):
-    place = csv_row[PLACE_INDEX]
-    # Remove all non utf8 characters
-    place = place.decode('utf-8','ignore').encode("utf-8")
-    # Put everything to lowercase
-    place = place.lower()
-    # Remove all commas
-    place = place.replace(",", "")
-    # Remove all "
-    place = place.replace("\"", "")
-    # Remove all single quotes
-    place = place.replace("'", "")
-    # Remove all \
-    place = place.replace("\\", "")
-    # Remove city (leading with a space)
-    place = place.replace(" city", "")
-    # Remove city (not leading with a space)
-    place = place.replace("city", "")
-    possible_province_labels = TO_PROVINCE_CODE_CONVERSION_MAP.keys()
-    province = None
-    city = None
-    country = None
-    for label in possible_province_labels:
-        province_string_index = place.lower().rfind(label)
-        if province_string_index >= 0:
-            province = TO_PROVINCE_CODE_CONVERSION_MAP[label]
-            city = place[:province_string_index].strip()
-            country = "CANADA"
-            if len(city) > 60:
-                city = city[:58] + ".."
-    if province is None:
-        for recognized_country in RECOGNIZED_COUNTRIES:
-            country_string_index = place.lower().rfind(recognized_country)
-            if country_string_index >= 0:
-                province = RECOGNIZED_COUNTRIES[recognized_country]
-                city = RECOGNIZED_COUNTRIES[recognized_country]
-                country = RECOGNIZED_COUNTRIES[recognized_country]
-
-    if city is None and province is None:
-        return None
-    else:
-        if city is None or city == "":
-            city = MAIN_CITY_FOR_PROVINCES[province]
-        return city, province, country,
+    return PLACE_RESOLVER.resolve(csv_row[PLACE_INDEX])
+
+
+POPULATION_FOOTNOTE_MARKER_PATTERN = re.compile(r"\s*\([\d,]+\)$")
+# "Ottawa-Gatineau (Ont.-Que.)": the name of the area and the abbreviations of its provinces
+CITY_POPULATION_NAME_PATTERN = re.compile(r"^(.+?)\s*\(([^()]+)\)$")
+YEAR_PATTERN = re.compile(r"^\d{4}$")
+
+
+def create_population_dimension():
+    execute_query("""
+        DROP TABLE IF EXISTS disaster_db.disaster_db_schema.population_dimension;
+        CREATE TABLE disaster_db.disaster_db_schema.population_dimension
+        (
+            population_key  SERIAL PRIMARY KEY,
+            city            VARCHAR(190),
+            province        VARCHAR(50),
+            country         VARCHAR(30),
+            year_actual     INT NOT NULL,
+            population      BIGINT NOT NULL
+        );
+    """)
+
+
+# Returns the (column index, year) pairs of the year columns of the header row of a wide StatCan table
+def get_population_year_columns(header_row):
+    return [(column_index, int(value)) for column_index, value in enumerate(header_row)
+            if YEAR_PATTERN.match(value.strip())]
+
+
+# Returns the (city, province, country, year, population) rows of the provinces and of Canada. The title and
+# survey lines above the "Geography" header and the footnotes below the last province are skipped
+def read_province_population_rows(csv_file_location):
+    population_rows = []
+    with open(csv_file_location, "rb") as csv_file:
+        csv_reader = csv.reader(csv_file)
+        for csv_row in csv_reader:
+            if len(csv_row) > 0 and csv_row[0] == "Geography":
+                year_columns = get_population_year_columns(csv_row)
+                break
+        else:
+            raise ValueError("No Geography header in " + csv_file_location)
+        for csv_row in csv_reader:
+            if len(csv_row) == 0 or csv_row[0].strip() == "" or csv_row[0] == "Footnotes:":
+                break
+            geography = POPULATION_FOOTNOTE_MARKER_PATTERN.sub("", csv_row[0]).strip().lower()
+            province = None if geography == "canada" else TO_PROVINCE_CODE_CONVERSION_MAP[geography]
+            for column_index, year in year_columns:
+                # Some territories have no estimate for the first years
+                if csv_row[column_index].strip() != "":
+                    population_rows.append((None, province, "CANADA", year, int(csv_row[column_index])))
+    return population_rows
+
+
+# Returns the (city, province, country, year, population) rows of the census metropolitan areas, the estimates
+# are given in thousands. An area spanning two provinces is attached to the first one.
+# The title lines above the year header and the notes below the last area are skipped
+def read_city_population_rows(csv_file_location):
+    population_rows = []
+    with open(csv_file_location, "rb") as csv_file:
+        csv_reader = csv.reader(csv_file)
+        for csv_row in csv_reader:
+            year_columns = get_population_year_columns(csv_row)
+            if len(year_columns) > 0:
+                break
+        else:
+            raise ValueError("No year header in " + csv_file_location)
+        for csv_row in csv_reader:
+            match = CITY_POPULATION_NAME_PATTERN.match(csv_row[0].strip()) if len(csv_row) > 0 else None
+            if match is None:
+                # Units line under the header, or the notes once past the last area
+                continue
+            city = match.group(1).decode("latin-1").lower().encode("utf-8")
+            province = CITY_POPULATION_PROVINCE_CODES[match.group(2).split("-")[0]]
+            for column_index, year in year_columns:
+                population = Decimal(csv_row[column_index].replace(",", "")) * 1000
+                population_rows.append((city, province, "CANADA", year, int(population)))
+    return population_rows
 
 
-def create_fact_table():
+def populate_population_dimension():
+    population_rows = read_province_population_rows(PROVINCE_POPULATION_CSV_FILE_LOCATION) + \
+        read_city_population_rows(CITY_POPULATION_CSV_FILE_LOCATION)
+    copy_rows_into_table("disaster_db.disaster_db_schema.population_dimension",
+                         ("city", "province", "country", "year_actual", "population"), population_rows)
+    print_success("Populated population dimension with %d rows" % len(population_rows))
+
+
+def create_populate_population_dimension():
+    create_population_dimension()
+    populate_population_dimension()
+
+
+# With partition_years, the fact table is created partitioned by ranges of start_date_key, without any partition
+def create_fact_table(partition_years=None):
+    partition_clause = ""
+    if partition_years is not None:
+        partition_clause = " PARTITION BY RANGE (start_date_key)"
     create_fact_table_query = """
         DROP TABLE IF EXISTS disaster_db.disaster_db_schema.fact;
         CREATE TABLE disaster_db.disaster_db_schema.fact
         (
             start_date_key INT REFERENCES disaster_db.disaster_db_schema.date_dimension(date_key),
             end_date_key INT REFERENCES disaster_db.disaster_db_schema.date_dimension(date_key),
-            location_key INT REFERENCES disaster_db.disaster_db_schema.location_dimension(location_key),
-            disaster_key INT REFERENCES disaster_db.disaster_db_schema.disaster_dimension(disaster_key),
-            summary_key INT REFERENCES disaster_db.disaster_db_schema.summary_dimension(summary_key),
-            cost_key INT REFERENCES disaster_db.disaster_db_schema.cost_dimension(cost_key),
+            location_key BIGINT REFERENCES disaster_db.disaster_db_schema.location_dimension(location_key),
+            disaster_key BIGINT REFERENCES disaster_db.disaster_db_schema.disaster_dimension(disaster_key),
+            summary_key BIGINT REFERENCES disaster_db.disaster_db_schema.summary_dimension(summary_key),
+            cost_key BIGINT REFERENCES disaster_db.disaster_db_schema.cost_dimension(cost_key),
             fatality_number DECIMAL,
             injured_number DECIMAL,
             evacuated_number DECIMAL,
             -- days_between_sighting_and_posting INT,
             PRIMARY KEY (start_date_key, end_date_key, location_key, disaster_key, summary_key)
-        );
-    """
+        )%s;
+    """ % partition_clause
     execute_query(create_fact_table_query)
     print_success("Successfully created fact table")
 
 
-def create_populate_fact_table(city_province_tuple_to_id_map, cost_tuple_to_id_map, disaster_tuple_to_id_map, summary_tuple_to_id_map):
-    create_fact_table()
-    with open(CSV_FILE_LOCATION, "rb") as csv_file:
-        csv_reader = csv.reader(csv_file)
-        with open(PROBLEMATIC_ROW_FILE_LOCATION, "wb") as problematic_csv_file:
-            csv_writer = csv.writer(problematic_csv_file)
-            next(csv_reader, None)
-            for csv_row in csv_reader:
+def get_fact_tuple(disaster_record, date_key_resolver, city_province_tuple_to_id_map, cost_tuple_to_id_map,
+                   disaster_tuple_to_id_map, summary_tuple_to_id_map):
+    # Get key from tuple to id maps when possible
+    cost_key = cost_tuple_to_id_map[disaster_record.cost_tuple]
+    location_key = city_province_tuple_to_id_map[disaster_record.city_province_country_tuple]
+    disaster_key = disaster_tuple_to_id_map[disaster_record.disaster_tuple]
+    summary_key = summary_tuple_to_id_map[disaster_record.summary_tuple]
+    # Date keys are computed in process instead of being queried from the date dimension
+    start_date_key = date_key_resolver.get_date_key(disaster_record.start_date)
+    end_date_key = date_key_resolver.get_date_key(disaster_record.end_date)
+    return (start_date_key, end_date_key, location_key, disaster_key, summary_key, cost_key,
+            disaster_record.fatality_number, disaster_record.injured_number, disaster_record.evacuated_number,)
+
+
+def insert_fact_row(query_batch, fact_tuple):
+    query_batch.execute("""
+        INSERT INTO disaster_db.disaster_db_schema.fact(start_date_key, end_date_key, location_key, disaster_key, summary_key, cost_key, fatality_number, injured_number, evacuated_number)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s);
+    """, fact_tuple)
+
+
+# Formats a value following the text format of COPY: NULL is \N and backslashes, tabs and newlines are escaped
+def to_copy_value(value):
+    if value is None:
+        return "\\N"
+    value = str(value)
+    return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+# Streams all the rows into the table with a single COPY FROM STDIN, then commits
+# Raises the database error (after rolling back) if any row is rejected
+def copy_rows_into_table(table_name, column_names, rows):
+    copy_lines_into_table(table_name, column_names, ("\t".join([to_copy_value(value) for value in row]) + "\n"
+                                                     for row in rows))
+
+
+# Same as copy_rows_into_table for rows already formatted as COPY text lines, newline included
+def copy_lines_into_table(table_name, column_names, lines):
+    buffer = StringIO()
+    buffer.writelines(lines)
+    buffer.seek(0)
+    connection = get_connection()
+    cursor = connection.cursor()
+    try:
+        cursor.copy_expert("COPY %s (%s) FROM STDIN" % (table_name, ", ".join(column_names)), buffer)
+        connection.commit()
+    except psycopg2.Error:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+        buffer.close()
+
+
+# Copies a batch of fact rows into the fact table. If the database rejects the batch, the rows are inserted
+# one at a time so that only the bad rows are diverted to the problematic rows file.
+# Returns the (disaster_record, fact_tuple) pairs that were inserted
+def load_fact_batch(disaster_records, fact_tuples, problematic_csv_writer, table_name=FACT_TABLE_NAME):
+    if len(fact_tuples) == 0:
+        return []
+    batch_start_time = time.time()
+    try:
+        copy_rows_into_table(table_name, FACT_COLUMN_NAMES, fact_tuples)
+        loaded_facts = zip(disaster_records, fact_tuples)
+    except psycopg2.Error:
+        log("COPY of fact batch failed, falling back to row by row insertion")
+        loaded_facts = insert_fact_rows(disaster_records, fact_tuples, problematic_csv_writer, "Fact batch row by row fallback")
+    elapsed_time = max(time.time() - batch_start_time, 0.000001)
+    print "Loaded fact batch of %d rows in %.3fs (%.0f rows/sec)" % (
+        len(loaded_facts), elapsed_time, len(loaded_facts) / elapsed_time)
+    return loaded_facts
+
+
+# Inserts the fact rows one at a time, diverting the rows rejected by the database to the problematic rows file.
+# Returns the (disaster_record, fact_tuple) pairs that were inserted
+def insert_fact_rows(disaster_records, fact_tuples, problematic_csv_writer, stage_name):
+    loaded_facts = []
+    with QueryBatch(stage_name) as query_batch:
+        for disaster_record, fact_tuple in zip(disaster_records, fact_tuples):
+            try:
+                insert_fact_row(query_batch, fact_tuple)
+                loaded_facts.append((disaster_record, fact_tuple,))
+            except psycopg2.Error:
+                problematic_csv_writer.writerow(disaster_record.csv_row)
+                METRICS.count("rows_diverted")
+    return loaded_facts
+
+
+# Resolves the fact row of every record. The records for which a key can't be resolved are written to the
+# problematic rows file, the others are returned along with their fact tuples
+def get_fact_tuples(disaster_records, problematic_csv_writer, city_province_tuple_to_id_map, cost_tuple_to_id_map,
+                    disaster_tuple_to_id_map, summary_tuple_to_id_map, date_key_resolver=None):
+    if date_key_resolver is None:
+        date_key_resolver = DateKeyResolver(load_date_dimension_keys())
+    resolved_disaster_records = []
+    fact_tuples = []
+    for disaster_record in disaster_records:
+        try:
+            fact_tuple = get_fact_tuple(disaster_record, date_key_resolver, city_province_tuple_to_id_map,
+                                        cost_tuple_to_id_map, disaster_tuple_to_id_map, summary_tuple_to_id_map)
+        except:
+            # Write row causing a problem to a csv file and continue
+            problematic_csv_writer.writerow(disaster_record.csv_row)
+            METRICS.count("rows_diverted")
+            continue
+        resolved_disaster_records.append(disaster_record)
+        fact_tuples.append(fact_tuple)
+    return resolved_disaster_records, fact_tuples
+
+
+# With partition_years, the fact table is partitioned by ranges of partition_years years of start_date_key,
+# the partitions covering the source dates are created and the rows are copied straight into their partition
+def create_populate_fact_table(disaster_records, city_province_tuple_to_id_map, cost_tuple_to_id_map, disaster_tuple_to_id_map,
+                               summary_tuple_to_id_map, partition_years=None):
+    create_fact_table(partition_years)
+    loaded_facts = []
+    with open(PROBLEMATIC_ROW_FILE_LOCATION, "wb") as problematic_csv_file:
+        csv_writer = csv.writer(problematic_csv_file)
+        resolved_disaster_records, fact_tuples = get_fact_tuples(
+            disaster_records, csv_writer, city_province_tuple_to_id_map, cost_tuple_to_id_map,
+            disaster_tuple_to_id_map, summary_tuple_to_id_map)
+        loaded_facts = load_fact_tuples(resolved_disaster_records, fact_tuples, csv_writer, partition_years)
+    print_success("Successfully populated fact table with %d rows" % len(loaded_facts))
+    create_load_state_table()
+    copy_rows_into_table(LOAD_STATE_TABLE_NAME, LOAD_STATE_COLUMN_NAMES, get_load_state_rows(loaded_facts))
+
+
+# Loads the resolved fact tuples in the fact table, in its partitions of partition_years years if it is partitioned.
+# Returns the (disaster_record, fact_tuple) pairs that were inserted
+def load_fact_tuples(resolved_disaster_records, fact_tuples, problematic_csv_writer, partition_years=None):
+    if partition_years is not None:
+        create_missing_fact_partitions([fact_tuple[0] for fact_tuple in fact_tuples], partition_years)
+    if not BULK_FACT_LOAD_TURNED_ON:
+        return insert_fact_rows(resolved_disaster_records, fact_tuples, problematic_csv_writer, "Fact table")
+    if partition_years is not None:
+        table_names = [get_fact_partition_name(fact_tuple[0], partition_years) for fact_tuple in fact_tuples]
+    else:
+        table_names = [FACT_TABLE_NAME] * len(fact_tuples)
+    # Rows are grouped by the table they are copied into, in the order of the source
+    table_name_to_facts_map = OrderedDict()
+    for table_name, disaster_record, fact_tuple in zip(table_names, resolved_disaster_records, fact_tuples):
+        table_name_to_facts_map.setdefault(table_name, ([], []))
+        table_name_to_facts_map[table_name][0].append(disaster_record)
+        table_name_to_facts_map[table_name][1].append(fact_tuple)
+    loaded_facts = []
+    for table_name, (table_disaster_records, table_fact_tuples) in table_name_to_facts_map.items():
+        for batch_start in range(0, len(table_fact_tuples), FACT_COPY_BATCH_SIZE):
+            batch_end = batch_start + FACT_COPY_BATCH_SIZE
+            loaded_facts.extend(load_fact_batch(table_disaster_records[batch_start:batch_end],
+                                                table_fact_tuples[batch_start:batch_end], problematic_csv_writer,
+                                                table_name))
+    return loaded_facts
+
+
+# Returns the first year of the partition of partition_years years containing the date key,
+# partitions start on the years that are multiples of partition_years (1900, 1910... for decades)
+def get_fact_partition_first_year(date_key, partition_years):
+    year = date_key // 10000
+    return year - year % partition_years
+
+
+def get_fact_partition_name(date_key, partition_years):
+    first_year = get_fact_partition_first_year(date_key, partition_years)
+    return "%s_%d_%d" % (FACT_TABLE_NAME, first_year, first_year + partition_years - 1)
+
+
+# Returns the (first date key, last date key + 1) ranges of the partitions of the fact table,
+# an empty list if the fact table isn't partitioned
+def get_fact_partition_ranges():
+    results = execute_query("""
+        SELECT  pg_get_expr(partition_class.relpartbound, partition_class.oid)
+        FROM    pg_inherits
+        INNER JOIN pg_class partition_class ON partition_class.oid = pg_inherits.inhrelid
+        WHERE   pg_inherits.inhparent = to_regclass(%s);
+    """, (FACT_TABLE_NAME,))
+    partition_ranges = []
+    for row in results:
+        match = FACT_PARTITION_BOUND_PATTERN.search(row[0])
+        if match is not None:
+            partition_ranges.append((int(match.group(1)), int(match.group(2))))
+    return partition_ranges
+
+
+# Creates the partitions of partition_years years of the fact table the start date keys fall in and that
+# don't exist yet. When partition_years is None, the size of the existing partitions is used, nothing is
+# done if the fact table isn't partitioned
+def create_missing_fact_partitions(start_date_keys, partition_years=None):
+    partition_ranges = get_fact_partition_ranges()
+    if partition_years is None:
+        if len(partition_ranges) == 0:
+            return
+        partition_years = (partition_ranges[0][1] - partition_ranges[0][0]) // 10000
+    created_partitions_count = 0
+    for first_year in sorted(set([get_fact_partition_first_year(start_date_key, partition_years)
+                                  for start_date_key in start_date_keys])):
+        first_date_key = first_year * 10000
+        if any([range_start <= first_date_key < range_end for range_start, range_end in partition_ranges]):
+            continue
+        execute_query("""
+            CREATE TABLE %s PARTITION OF %s
+            FOR VALUES FROM (%d) TO (%d);
+        """ % (get_fact_partition_name(first_date_key, partition_years), FACT_TABLE_NAME, first_date_key,
+               (first_year + partition_years) * 10000))
+        partition_ranges.append((first_date_key, (first_year + partition_years) * 10000))
+        created_partitions_count += 1
+    if created_partitions_count > 0:
+        print_success("Created %d fact table partitions of %d years" % (created_partitions_count, partition_years))
+
+
+# The load state keeps the hash of every source row loaded in the fact table along with the key of its fact row
+def create_load_state_table():
+    execute_query("""
+        DROP TABLE IF EXISTS disaster_db.disaster_db_schema.load_state;
+        CREATE TABLE disaster_db.disaster_db_schema.load_state
+        (
+            row_hash        CHAR(40),
+            start_date_key  INT,
+            end_date_key    INT,
+            location_key    BIGINT,
+            disaster_key    BIGINT,
+            summary_key     BIGINT,
+            PRIMARY KEY (row_hash)
+        );
+    """)
+
+
+# Bumps the version of the data of the data mart after a load, so results computed from the previous data aren't
+# reused. The table survives full loads, its single row holds a counter and the time of the last load
+def bump_data_version():
+    results = execute_query("""
+        CREATE TABLE IF NOT EXISTS disaster_db.disaster_db_schema.data_version
+        (
+            id          INT PRIMARY KEY CHECK (id = 1),
+            version     BIGINT NOT NULL,
+            loaded_at   TIMESTAMP NOT NULL
+        );
+        INSERT INTO disaster_db.disaster_db_schema.data_version(id, version, loaded_at)
+        VALUES (1, 1, clock_timestamp())
+        ON CONFLICT (id) DO UPDATE
+        SET     version = data_version.version + 1,
+                loaded_at = EXCLUDED.loaded_at
+        RETURNING version, TO_CHAR(loaded_at, 'YYYYMMDDHH24MISSUS');
+    """)
+    # execute_query returns no rows when the statement failed, its error is already printed
+    print_success("Data version bumped to %s" % (get_data_version_stamp(*results[0]) if results else None))
+
+
+def get_data_version_stamp(version, loaded_at_text):
+    return "%d-%s" % (version, loaded_at_text)
+
+
+# Returns a stamp of the version of the data of the data mart, None before the first load. The time of the load
+# is part of it, so a database recreated from scratch doesn't reuse the stamps of the previous one
+def get_data_version():
+    if not table_exists(DATA_VERSION_TABLE_NAME):
+        return None
+    results = execute_query("""
+        SELECT  version, TO_CHAR(loaded_at, 'YYYYMMDDHH24MISSUS')
+        FROM    disaster_db.disaster_db_schema.data_version;
+    """)
+    if len(results) == 0:
+        return None
+    return get_data_version_stamp(results[0][0], results[0][1])
+
+
+def get_load_state_rows(loaded_facts):
+    return [(disaster_record.row_hash,) + fact_tuple[:5] for disaster_record, fact_tuple in loaded_facts]
+
+
+# The aggregate tables hold the fact measures pre-joined with their dimensions and summed, the analytic
+# queries of sql_scripts read them instead of joining the fact table every time. They are plain tables
+# rather than materialized views so the create functions can keep dropping the fact table on their own:
+# disaster_aggregate is keyed by year, month, province, country, disaster type and disaster group,
+# city_disaster_aggregate by city, province, country, disaster type and disaster group
+def create_aggregate_tables():
+    execute_query("""
+        DROP TABLE IF EXISTS disaster_db.disaster_db_schema.disaster_aggregate;
+        CREATE TABLE disaster_db.disaster_db_schema.disaster_aggregate
+        (
+            year_actual             INT,
+            month_actual            INT,
+            month_name              VARCHAR(9),
+            province                VARCHAR(50),
+            country                 VARCHAR(30),
+            disaster_type           VARCHAR(40),
+            disaster_group          VARCHAR(15),
+            event_count             BIGINT,
+            total_fatalities        DECIMAL,
+            total_injured           DECIMAL,
+            total_evacuated         DECIMAL,
+            total_normalized_cost   DECIMAL,
+            population              BIGINT,
+            fatalities_per_100k     DECIMAL,
+            injured_per_100k        DECIMAL,
+            normalized_cost_per_100k DECIMAL
+        );
+        DROP TABLE IF EXISTS disaster_db.disaster_db_schema.city_disaster_aggregate;
+        CREATE TABLE disaster_db.disaster_db_schema.city_disaster_aggregate
+        (
+            city                    VARCHAR(190),
+            province                VARCHAR(50),
+            country                 VARCHAR(30),
+            disaster_type           VARCHAR(40),
+            disaster_group          VARCHAR(15),
+            event_count             BIGINT,
+            total_fatalities        DECIMAL,
+            total_injured           DECIMAL,
+            total_evacuated         DECIMAL,
+            total_normalized_cost   DECIMAL
+        );
+    """)
+
+
+# Recomputes the aggregate tables from the fact table in a single transaction, so the analytic queries
+# never see them partially refreshed. The rates per 100 000 inhabitants use the population of the province
+# for the year, they are NULL outside of the years and provinces of the population dimension
+def refresh_aggregate_tables():
+    if not table_exists("disaster_db.disaster_db_schema.disaster_aggregate") or \
+            not table_exists("disaster_db.disaster_db_schema.city_disaster_aggregate"):
+        create_aggregate_tables()
+    execute_query("""
+        DELETE FROM disaster_db.disaster_db_schema.disaster_aggregate;
+        INSERT INTO disaster_db.disaster_db_schema.disaster_aggregate
+        SELECT      event.*,
+                    population_dimension.population,
+                    event.total_fatalities * 100000 / population_dimension.population,
+                    event.total_injured * 100000 / population_dimension.population,
+                    event.total_normalized_cost * 100000 / population_dimension.population
+        FROM        (
+            SELECT      date_dimension.year_actual,
+                        date_dimension.month_actual,
+                        date_dimension.month_name,
+                        location_dimension.province,
+                        location_dimension.country,
+                        disaster_dimension.disaster_type,
+                        disaster_dimension.disaster_group,
+                        COUNT(*) AS event_count,
+                        SUM(fact.fatality_number) AS total_fatalities,
+                        SUM(fact.injured_number) AS total_injured,
+                        SUM(fact.evacuated_number) AS total_evacuated,
+                        SUM(cost_dimension.normalized_total_cost) AS total_normalized_cost
+            FROM        disaster_db.disaster_db_schema.fact
+            INNER JOIN  disaster_db.disaster_db_schema.date_dimension ON fact.start_date_key = date_dimension.date_key
+            INNER JOIN  disaster_db.disaster_db_schema.location_dimension ON fact.location_key = location_dimension.location_key
+            INNER JOIN  disaster_db.disaster_db_schema.disaster_dimension ON fact.disaster_key = disaster_dimension.disaster_key
+            LEFT JOIN   disaster_db.disaster_db_schema.cost_dimension ON fact.cost_key = cost_dimension.cost_key
+            GROUP BY    date_dimension.year_actual, date_dimension.month_actual, date_dimension.month_name,
+                        location_dimension.province, location_dimension.country,
+                        disaster_dimension.disaster_type, disaster_dimension.disaster_group
+        ) AS event
+        LEFT JOIN   disaster_db.disaster_db_schema.population_dimension
+                    ON population_dimension.city IS NULL AND population_dimension.province = event.province
+                    AND population_dimension.country = event.country
+                    AND population_dimension.year_actual = event.year_actual;
+        DELETE FROM disaster_db.disaster_db_schema.city_disaster_aggregate;
+        INSERT INTO disaster_db.disaster_db_schema.city_disaster_aggregate
+        SELECT      location_dimension.city,
+                    location_dimension.province,
+                    location_dimension.country,
+                    disaster_dimension.disaster_type,
+                    disaster_dimension.disaster_group,
+                    COUNT(*),
+                    SUM(fact.fatality_number),
+                    SUM(fact.injured_number),
+                    SUM(fact.evacuated_number),
+                    SUM(cost_dimension.normalized_total_cost)
+        FROM        disaster_db.disaster_db_schema.fact
+        INNER JOIN  disaster_db.disaster_db_schema.location_dimension ON fact.location_key = location_dimension.location_key
+        INNER JOIN  disaster_db.disaster_db_schema.disaster_dimension ON fact.disaster_key = disaster_dimension.disaster_key
+        LEFT JOIN   disaster_db.disaster_db_schema.cost_dimension ON fact.cost_key = cost_dimension.cost_key
+        GROUP BY    location_dimension.city, location_dimension.province, location_dimension.country,
+                    disaster_dimension.disaster_type, disaster_dimension.disaster_group;
+    """)
+    print_success("Aggregate tables refreshed")
+
+
+def drop_star_schema_indexes():
+    execute_query("".join(["DROP INDEX IF EXISTS disaster_db.disaster_db_schema.%s;" % index_name
+                           for index_name, _, _ in STAR_SCHEMA_INDEXES]))
+
+
+# Creates the secondary indexes of the data mart, then refreshes the planner statistics of its tables
+def create_star_schema_indexes():
+    table_names = []
+    for index_name, table_name, indexed_columns in STAR_SCHEMA_INDEXES:
+        execute_query("CREATE INDEX IF NOT EXISTS %s ON disaster_db.disaster_db_schema.%s %s;" % (
+            index_name, table_name, indexed_columns))
+        if table_name not in table_names:
+            table_names.append(table_name)
+    for table_name in ["summary_dimension", "cost_dimension"] + table_names:
+        execute_query("ANALYZE disaster_db.disaster_db_schema.%s;" % table_name)
+    print_success("Created %d indexes and analyzed %d tables" % (len(STAR_SCHEMA_INDEXES), len(table_names) + 2))
+
+
+# Returns the locations of the analytic scripts of sql_scripts, the date dimension creation script excluded
+def get_analytic_script_locations():
+    return [os.path.join(SQL_SCRIPTS_DIRECTORY, file_name) for file_name in sorted(os.listdir(SQL_SCRIPTS_DIRECTORY))
+            if file_name.endswith(".sql") and file_name != DATE_DIMENSION_SCRIPT_FILE_NAME]
+
+
+# Prints the plan of the query of every analytic script. The query is the last statement of the script,
+# the statements before it (SET SEARCH_PATH) are run as they are
+def print_analytic_script_plans(title):
+    print bcolors.HEADER + "Query plans " + title + bcolors.ENDC
+    for script_location in get_analytic_script_locations():
+        with open(script_location, "r") as script_file:
+            statements = [statement for statement in script_file.read().split(";") if statement.strip() != ""]
+        statements[-1] = "EXPLAIN " + statements[-1]
+        print bcolors.BOLD + script_location + bcolors.ENDC
+        for row in execute_query(";".join(statements) + ";"):
+            print "    " + row[0]
+
+
+def build_indexes_and_statistics(explain_scripts):
+    if explain_scripts:
+        print_analytic_script_plans("before the indexes and statistics")
+    with timed_stage("Indexes and statistics"):
+        create_star_schema_indexes()
+    if explain_scripts:
+        print_analytic_script_plans("after the indexes and statistics")
+
+
+def table_exists(table_name):
+    return execute_query("SELECT to_regclass(%s);", (table_name,))[0][0] is not None
+
+
+# Returns a map of the natural attributes of every member of a dimension to its key.
+# The query must select the attributes in the order of the dimension tuples, followed by the key
+def load_tuple_to_id_map(query):
+    return dict([(row[:-1], row[-1]) for row in stream_query(query)])
+
+
+# Returns the existing dimension tuple to key maps, by dimension name
+def load_tuple_to_id_maps():
+    return {
+        "summary": load_tuple_to_id_map("""
+            SELECT  summary, keyword_1, keyword_2, keyword_3, summary_key
+            FROM    disaster_db.disaster_db_schema.summary_dimension;
+        """),
+        "disaster": load_tuple_to_id_map("""
+            SELECT  disaster_type, disaster_subgroup, disaster_group, disaster_category, magnitude, utility_people_affected, disaster_key
+            FROM    disaster_db.disaster_db_schema.disaster_dimension;
+        """),
+        "cost": load_tuple_to_id_map("""
+            SELECT  estimated_total_cost, normalized_total_cost, federal_dfaa_payments, provincial_dfaa_payments,
+                    provincial_department_payments, municipal_cost, ogd_cost, insurance_payments, ngo_cost, cost_key
+            FROM    disaster_db.disaster_db_schema.cost_dimension;
+        """),
+        "location": load_tuple_to_id_map("""
+            SELECT  city, province, country, location_key
+            FROM    disaster_db.disaster_db_schema.location_dimension;
+        """)
+    }
+
+
+# Loads only the new and amended source rows in the existing data mart: new dimension members are inserted,
+# facts of source rows that were amended or removed since the last load are deleted and the facts of new
+# rows are upserted. Source rows are identified by the hash of their content, kept in the load state table
+def update_data_mart(disaster_records, workers, explain_scripts):
+    # Data marts loaded before the population dimension existed get it, and the aggregate columns using it
+    if not table_exists("disaster_db.disaster_db_schema.population_dimension"):
+        with timed_stage("Population dimension"):
+            create_populate_population_dimension()
+        create_aggregate_tables()
+    with timed_stage("Date dimension"):
+        extend_date_dimension(*get_source_date_range(get_record_date_strings(disaster_records)))
+    # The indexes would be maintained row by row during the load, they are rebuilt once it is done
+    drop_star_schema_indexes()
+    tuple_to_id_maps = populate_dimensions(disaster_records, load_tuple_to_id_maps(), workers,
+                                           data_mart_uses_hash_surrogate_keys())
+    with timed_stage("Fact table update"):
+        update_fact_table(disaster_records, tuple_to_id_maps["location"], tuple_to_id_maps["cost"],
+                          tuple_to_id_maps["disaster"], tuple_to_id_maps["summary"])
+    with timed_stage("Aggregate tables"):
+        refresh_aggregate_tables()
+    build_indexes_and_statistics(explain_scripts)
+
+
+def update_fact_table(disaster_records, city_province_tuple_to_id_map, cost_tuple_to_id_map, disaster_tuple_to_id_map,
+                      summary_tuple_to_id_map):
+    # Keyed on the row hash since source rows differing only in their measures share a fact key
+    row_hash_to_fact_key_map = dict([(row[0], row[1:]) for row in stream_query("""
+        SELECT  row_hash, start_date_key, end_date_key, location_key, disaster_key, summary_key
+        FROM    disaster_db.disaster_db_schema.load_state;
+    """)])
+    source_row_hashes = set([disaster_record.row_hash for disaster_record in disaster_records])
+    removed_row_hashes = [row_hash for row_hash in row_hash_to_fact_key_map if row_hash not in source_row_hashes]
+    # Rows still in the source sharing their fact key with a removed row are upserted again to restore its measures
+    removed_fact_keys = set([row_hash_to_fact_key_map[row_hash] for row_hash in removed_row_hashes])
+    new_disaster_records = [disaster_record for disaster_record in disaster_records
+                            if disaster_record.row_hash not in row_hash_to_fact_key_map or
+                            row_hash_to_fact_key_map[disaster_record.row_hash] in removed_fact_keys]
+    upserted_rows_count = 0
+    with open(PROBLEMATIC_ROW_FILE_LOCATION, "wb") as problematic_csv_file:
+        csv_writer = csv.writer(problematic_csv_file)
+        # Keys are resolved before the batch is opened since resolving them runs queries that commit
+        resolved_disaster_records, fact_tuples = get_fact_tuples(
+            new_disaster_records, csv_writer, city_province_tuple_to_id_map, cost_tuple_to_id_map,
+            disaster_tuple_to_id_map, summary_tuple_to_id_map)
+        # New rows can start in a period the partitions of a partitioned fact table don't cover yet
+        create_missing_fact_partitions([fact_tuple[0] for fact_tuple in fact_tuples])
+        with QueryBatch("Fact table update") as query_batch:
+            # Facts of the rows that were amended or removed from the source are deleted first, unless a row
+            # still in the source shares their fact key, amended rows come back as new rows
+            for row_hash in removed_row_hashes:
+                query_batch.execute("""
+                    DELETE FROM disaster_db.disaster_db_schema.load_state
+                    WHERE   row_hash = %s;
+                """, (row_hash,))
+                query_batch.execute("""
+                    DELETE FROM disaster_db.disaster_db_schema.fact
+                    WHERE   (start_date_key, end_date_key, location_key, disaster_key, summary_key) = (%s, %s, %s, %s, %s)
+                    AND     NOT EXISTS (
+                                SELECT  1
+                                FROM    disaster_db.disaster_db_schema.load_state
+                                WHERE   (start_date_key, end_date_key, location_key, disaster_key, summary_key) = (%s, %s, %s, %s, %s));
+                """, row_hash_to_fact_key_map[row_hash] * 2)
+            # Like in a full load, a new row whose fact key is taken by a row still in the source is diverted rather
+            # than overwriting its fact: the facts of the removed rows are gone, so the insert only conflicts with
+            # a fact of a row still in the source. The rows already in the load state own their fact and update it
+            for disaster_record, fact_tuple in zip(resolved_disaster_records, fact_tuples):
+                if disaster_record.row_hash in row_hash_to_fact_key_map:
+                    conflict_action = """DO UPDATE
+                        SET     cost_key = EXCLUDED.cost_key,
+                                fatality_number = EXCLUDED.fatality_number,
+                                injured_number = EXCLUDED.injured_number,
+                                evacuated_number = EXCLUDED.evacuated_number"""
+                else:
+                    conflict_action = "DO NOTHING"
                 try:
-                    # Get key from tuple to id maps when possible
-                    cost_tuple = get_cost_tuple(csv_row)
-                    cost_key = cost_tuple_to_id_map[cost_tuple]
-                    city_province_country_tuple = get_city_province_country_tuple_for_place(csv_row)
-                    location_key = city_province_tuple_to_id_map[city_province_country_tuple]
-                    disaster_tuple = get_disaster_tuple(csv_row)
-                    disaster_key = disaster_tuple_to_id_map[disaster_tuple]
-                    summary_tuple = get_summary_tuple_for_comment(csv_row)
-                    summary_key = summary_tuple_to_id_map[summary_tuple]
-                    # For date dimension, we need to run a query to get the start_date_key
-                    start_date = csv_row[EVENT_START_DATE_INDEX].split(" ")[0]
-                    start_date_query_result = execute_query("""
-                        SELECT  date_key FROM disaster_db.disaster_db_schema.date_dimension
-                        WHERE   date_actual = TO_DATE('%s', 'MM/DD/YYYY') LIMIT 1;
-                    """ % start_date)
-                    if len(start_date_query_result) == 1:
-                        start_date_key = start_date_query_result[0][0]
-                    else:
-                        print "no start date: " + csv_row
-                        continue
-                    # For date dimension, we need to run a query to get the end_date_key
-                    end_date = csv_row[EVENT_END_DATE_INDEX].split(" ")[0]
-                    end_date_query_result = execute_query("""
-                        SELECT  date_key FROM disaster_db.disaster_db_schema.date_dimension
-                        WHERE   date_actual = TO_DATE('%s', 'MM/DD/YYYY') LIMIT 1;
-                    """ % end_date)
-                    if len(end_date_query_result) == 1:
-                        end_date_key = end_date_query_result[0][0]
-                    else:
-                        print "no end date: " + csv_row
-                        continue
-                    # That's it for getting the keys, now we get the facts/measures
-                    fatality_number = csv_row[FATALITIES_INDEX]
-                    if fatality_number == "":
-                        fatality_number = "NULL"
-                    injured_number = csv_row[INJURED_INFECTED_INDEX]
-                    if injured_number == "":
-                        injured_number = "NULL"
-                    evacuated_number = csv_row[EVACUATED_INDEX]
-                    if evacuated_number == "":
-                        evacuated_number = "NULL"
-                    # Finally, let's try inserting the row into the fact table
-                    insert_query = """
+                    upserted_rows = query_batch.execute("""
                         INSERT INTO disaster_db.disaster_db_schema.fact(start_date_key, end_date_key, location_key, disaster_key, summary_key, cost_key, fatality_number, injured_number, evacuated_number)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s);
-                    """ % (start_date_key, end_date_key, location_key, disaster_key, summary_key, cost_key, fatality_number, injured_number, evacuated_number)
-                    execute_query(insert_query)
-                except:
-                    # Write row causing a problem to a csv file and continue
-                    csv_writer.writerow(csv_row)
+                        VALUES (%%s, %%s, %%s, %%s, %%s, %%s, %%s, %%s, %%s)
+                        ON CONFLICT (start_date_key, end_date_key, location_key, disaster_key, summary_key) %s
+                        RETURNING 1;
+                    """ % conflict_action, fact_tuple)
+                except psycopg2.Error:
+                    upserted_rows = []
+                if len(upserted_rows) == 0:
+                    csv_writer.writerow(disaster_record.csv_row)
+                    METRICS.count("rows_diverted")
                     continue
-            print_success("Successfully populated fact table")
+                query_batch.execute("""
+                    INSERT INTO disaster_db.disaster_db_schema.load_state(row_hash, start_date_key, end_date_key, location_key, disaster_key, summary_key)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (row_hash) DO NOTHING;
+                """, get_load_state_rows([(disaster_record, fact_tuple,)])[0])
+                upserted_rows_count += 1
+    print_success("Updated fact table: %d new or amended rows upserted, %d removed or amended rows deleted" % (
+        upserted_rows_count, len(removed_row_hashes)))
 
 
-def create_data_mart():
+def data_mart_exists():
+    for table_name in ("date_dimension", "summary_dimension", "disaster_dimension", "cost_dimension",
+                       "location_dimension", "fact", "load_state"):
+        if not table_exists("disaster_db.disaster_db_schema." + table_name):
+            return False
+    return True
+
+
+# Table, key column and attribute columns of every dimension, the attributes in the order of its member tuples
+# followed by the columns derived from them (see get_dimension_row)
+DIMENSION_TABLE_COLUMNS = {
+    "summary": ("summary_dimension", "summary_key", ("summary", "keyword_1", "keyword_2", "keyword_3")),
+    "disaster": ("disaster_dimension", "disaster_key", ("disaster_type", "disaster_subgroup", "disaster_group",
+                                                        "disaster_category", "magnitude", "utility_people_affected")),
+    "cost": ("cost_dimension", "cost_key", ("estimated_total_cost", "normalized_total_cost", "federal_dfaa_payments",
+                                            "provincial_dfaa_payments", "provincial_department_payments",
+                                            "municipal_cost", "ogd_cost", "insurance_payments", "ngo_cost")),
+    "location": ("location_dimension", "location_key", ("city", "province", "country", "canada"))
+}
+
+
+def get_dimension_row(dimension_name, member_tuple):
+    if dimension_name == "location":
+        return member_tuple + (member_tuple[2] == "CANADA",)
+    return member_tuple
+
+
+# Returns the 64 bit surrogate key of a dimension member, derived from its natural attributes only:
+# the same member gets the same key in every load
+def get_hash_surrogate_key(member_tuple):
+    canonical_values = []
+    for value in member_tuple:
+        if value is None:
+            canonical_values.append("\x00")
+        elif isinstance(value, unicode):
+            canonical_values.append(value.encode("utf-8"))
+        else:
+            canonical_values.append(str(value))
+    return struct.unpack(">q", hashlib.sha1("\x1f".join(canonical_values)).digest()[:8])[0]
+
+
+# Returns the distinct members of member_tuples missing from tuple_to_id_map, in the order they first appear
+def get_new_member_tuples(member_tuples, tuple_to_id_map):
+    new_member_tuples = OrderedDict()
+    for member_tuple in member_tuples:
+        if member_tuple is not None and member_tuple not in tuple_to_id_map:
+            new_member_tuples[member_tuple] = True
+    return new_member_tuples.keys()
+
+
+# Sends the rows DIMENSION_INSERT_BATCH_SIZE per multi-row statement. A rejected batch is sent again one row
+# at a time, so only its bad rows are left out. Returns the (index in rows, returned row) pairs of the rows
+# inserted, the returned row is None without fetch. With ON CONFLICT DO NOTHING the rows skipped return nothing,
+# so only the returned rows and not their indexes can be relied on
+def insert_dimension_rows(query_batch, insert_query, rows, fetch=False):
+    inserted_rows = []
+    for batch_start in range(0, len(rows), DIMENSION_INSERT_BATCH_SIZE):
+        batch_rows = rows[batch_start:batch_start + DIMENSION_INSERT_BATCH_SIZE]
+        batch_indexes = range(batch_start, batch_start + len(batch_rows))
+        batch_start_time = time.time()
+        try:
+            results = query_batch.execute_values(insert_query, batch_rows, fetch)
+            inserted_rows.extend(zip(batch_indexes, results if fetch else [None] * len(batch_rows)))
+        except psycopg2.Error:
+            log("Batch of %d dimension rows rejected, inserting them one at a time" % len(batch_rows))
+            for row_index, row in zip(batch_indexes, batch_rows):
+                try:
+                    results = query_batch.execute_values(insert_query, [row], fetch)
+                except psycopg2.Error:
+                    print_stack_trace()
+                    continue
+                if fetch and len(results) == 0:
+                    continue
+                inserted_rows.append((row_index, results[0] if fetch else None))
+        log("Inserted batch of %d dimension rows in %.3fs" % (len(batch_rows), time.time() - batch_start_time))
+    return inserted_rows
+
+
+# Only the members missing from tuple_to_id_map are inserted, the map is completed and returned. The members are
+# sent DIMENSION_INSERT_BATCH_SIZE per INSERT ... RETURNING statement, the SERIAL keys come back in the order
+# of the members sent
+def populate_dimension_in_batches(dimension_name, member_tuples, tuple_to_id_map=None):
+    if tuple_to_id_map is None:
+        tuple_to_id_map = {}
+    start_time = time.time()
+    table_name, key_column_name, column_names = DIMENSION_TABLE_COLUMNS[dimension_name]
+    new_member_tuples = get_new_member_tuples(member_tuples, tuple_to_id_map)
+    insert_query = """
+        INSERT INTO disaster_db.disaster_db_schema.%s(%s)
+        VALUES %%s
+        RETURNING %s;
+    """ % (table_name, ", ".join(column_names), key_column_name)
+    with QueryBatch(dimension_name.capitalize() + " dimension") as query_batch:
+        inserted_rows = insert_dimension_rows(query_batch, insert_query, [
+            get_dimension_row(dimension_name, member_tuple) for member_tuple in new_member_tuples], fetch=True)
+    for row_index, returned_row in inserted_rows:
+        tuple_to_id_map[new_member_tuples[row_index]] = returned_row[0]
+    print_success("Populated %s dimension with %d rows in %.3fs" % (dimension_name, len(inserted_rows),
+                                                                    time.time() - start_time))
+    return tuple_to_id_map
+
+
+# Populates a dimension created with hash_surrogate_keys. The keys of the members are known without asking the
+# database, the members missing from tuple_to_id_map are sent in batches returning only the keys inserted.
+# Members already in the dimension are skipped by the database, a skipped key stored with other attributes
+# than the member is a collision
+def populate_dimension_with_hash_keys(dimension_name, member_tuples, tuple_to_id_map=None):
+    if tuple_to_id_map is None:
+        tuple_to_id_map = {}
+    start_time = time.time()
+    table_name, key_column_name, column_names = DIMENSION_TABLE_COLUMNS[dimension_name]
+    new_member_tuples = get_new_member_tuples(member_tuples, tuple_to_id_map)
+    key_to_member_tuple_map = {}
+    keys = []
+    for member_tuple in new_member_tuples:
+        key = get_hash_surrogate_key(member_tuple)
+        if key in key_to_member_tuple_map:
+            raise HashKeyCollisionException("%r and %r have the same key %d" % (
+                key_to_member_tuple_map[key], member_tuple, key))
+        key_to_member_tuple_map[key] = member_tuple
+        keys.append(key)
+    insert_query = """
+        INSERT INTO disaster_db.disaster_db_schema.%s(%s, %s)
+        VALUES %%s
+        ON CONFLICT (%s) DO NOTHING
+        RETURNING %s;
+    """ % (table_name, key_column_name, ", ".join(column_names), key_column_name, key_column_name)
+    with QueryBatch(dimension_name.capitalize() + " dimension") as query_batch:
+        inserted_rows = insert_dimension_rows(query_batch, insert_query, [
+            (key,) + get_dimension_row(dimension_name, member_tuple)
+            for key, member_tuple in zip(keys, new_member_tuples)], fetch=True)
+    inserted_keys = set([returned_row[0] for _, returned_row in inserted_rows])
+    skipped_keys = [key for key in keys if key not in inserted_keys]
+    stored_keys = set()
+    if len(skipped_keys) > 0:
+        for stored_row in stream_query("""
+            SELECT  %s, %s
+            FROM    disaster_db.disaster_db_schema.%s
+            WHERE   %s = ANY(%%s);
+        """ % (key_column_name, ", ".join(column_names), table_name, key_column_name), (skipped_keys,)):
+            member_tuple = key_to_member_tuple_map[stored_row[0]]
+            if tuple(stored_row[1:]) != get_dimension_row(dimension_name, member_tuple):
+                raise HashKeyCollisionException("%r and the stored %r have the same key %d" % (
+                    member_tuple, tuple(stored_row[1:]), stored_row[0]))
+            stored_keys.add(stored_row[0])
+    # Keys neither inserted nor stored are those of rejected rows
+    for key, member_tuple in zip(keys, new_member_tuples):
+        if key in inserted_keys or key in stored_keys:
+            tuple_to_id_map[member_tuple] = key
+    print_success("Populated %s dimension with %d rows in %.3fs" % (dimension_name, len(inserted_rows),
+                                                                    time.time() - start_time))
+    return tuple_to_id_map
+
+
+# Returns whether the dimensions of the existing data mart were created with hash_surrogate_keys
+def data_mart_uses_hash_surrogate_keys():
+    return execute_query("""
+        SELECT  column_default IS NULL
+        FROM    information_schema.columns
+        WHERE   table_schema = 'disaster_db_schema' AND table_name = 'summary_dimension' AND column_name = 'summary_key';
+    """)[0][0]
+
+
+def get_dimension_populate_function(dimension_name, hash_surrogate_keys=False):
+    if hash_surrogate_keys:
+        return lambda member_tuples, tuple_to_id_map=None: populate_dimension_with_hash_keys(
+            dimension_name, member_tuples, tuple_to_id_map)
+    return DIMENSION_POPULATE_FUNCTIONS[dimension_name]
+
+
+DIMENSION_POPULATE_FUNCTIONS = {
+    "summary": populate_summary_dimension,
+    "disaster": populate_disaster_dimension,
+    "cost": populate_cost_dimension,
+    "location": populate_location_dimension
+}
+
+
+# Measures the code run in the with block as a stage of METRICS and prints how long it took
+@contextmanager
+def timed_stage(stage_name):
+    with METRICS.stage(stage_name) as stage_metrics:
+        yield
+    print "Stage %s took %.3fs" % (stage_name, stage_metrics["elapsed_seconds"])
+
+
+# Runs in a worker process of populate_dimensions, with its own connection pool and metrics.
+# Returns the completed tuple to key map of the dimension and the metrics of its stage
+def populate_dimension_in_worker(dimension_name, member_tuples, tuple_to_id_map, hash_surrogate_keys):
+    global METRICS
+    METRICS = PipelineMetrics()
+    with METRICS.stage(dimension_name.capitalize() + " dimension") as stage_metrics:
+        tuple_to_id_map = get_dimension_populate_function(dimension_name, hash_surrogate_keys)(member_tuples,
+                                                                                                tuple_to_id_map)
+    return tuple_to_id_map, stage_metrics
+
+
+# Inserts the members of the summary, disaster, cost and location dimensions that are not in tuple_to_id_maps
+# yet and returns the completed tuple to key maps by dimension name. The dimensions are independent from each
+# other: with more than one worker, each of them is deduplicated and loaded in a worker process
+def populate_dimensions(disaster_records, tuple_to_id_maps, workers, hash_surrogate_keys=False):
+    write_problematic_places(disaster_records)
+    member_tuples = {
+        "summary": [disaster_record.summary_tuple for disaster_record in disaster_records],
+        "disaster": [disaster_record.disaster_tuple for disaster_record in disaster_records],
+        "cost": [disaster_record.cost_tuple for disaster_record in disaster_records],
+        "location": [disaster_record.city_province_country_tuple for disaster_record in disaster_records]
+    }
+    dimension_names = ("summary", "disaster", "cost", "location")
+    if workers <= 1:
+        completed_tuple_to_id_maps = {}
+        for dimension_name in dimension_names:
+            with timed_stage(dimension_name.capitalize() + " dimension"):
+                completed_tuple_to_id_maps[dimension_name] = get_dimension_populate_function(
+                    dimension_name, hash_surrogate_keys)(member_tuples[dimension_name],
+                                                         tuple_to_id_maps.get(dimension_name))
+        return completed_tuple_to_id_maps
+    # The connections can't be shared with the forked workers, every worker opens its own pool
+    close_connections()
+    with METRICS.stage("Dimensions") as stage_metrics:
+        pool = multiprocessing.Pool(min(workers, len(dimension_names)))
+        try:
+            async_results = dict([(dimension_name, pool.apply_async(populate_dimension_in_worker, (
+                dimension_name, member_tuples[dimension_name], tuple_to_id_maps.get(dimension_name),
+                hash_surrogate_keys)))
+                for dimension_name in dimension_names])
+            completed_tuple_to_id_maps = {}
+            for dimension_name in dimension_names:
+                stage_name = dimension_name.capitalize() + " dimension"
+                completed_tuple_to_id_maps[dimension_name], worker_stage_metrics = async_results[dimension_name].get()
+                METRICS.merge_stage(stage_name, worker_stage_metrics)
+                print "Stage %s took %.3fs in its worker" % (stage_name, worker_stage_metrics["elapsed_seconds"])
+        finally:
+            pool.close()
+            pool.join()
+    print "Stage Dimensions took %.3fs with %d workers" % (stage_metrics["elapsed_seconds"], workers)
+    return completed_tuple_to_id_maps
+
+
+# Runs a generator of batches in a producer thread and hands the batches to a consumer on the calling thread, the
+# one holding the database connection, through a queue of at most queue_size batches: the producer waits when the
+# queue is full and the consumer when it is empty. An error on either side stops both and is raised to the caller.
+# The depth of the queue and the time each side waited on the other are added to the metrics of the stage:
+#     BatchPipeline("Streaming pipeline").run(lambda: read_disaster_record_chunks(...), load_chunk)
+class BatchPipeline(object):
+    def __init__(self, stage_name, queue_size=None):
+        self.stage_name = stage_name
+        self.batch_queue = Queue.Queue(queue_size if queue_size is not None else PIPELINE_QUEUE_SIZE)
+        self.stop_event = threading.Event()
+        self.batch_count = 0
+        self.queue_depths = []
+        self.producer_stall_seconds = 0.0
+        self.consumer_stall_seconds = 0.0
+
+    def run(self, produce_batches, consume_batch):
+        with METRICS.stage(self.stage_name) as stage_metrics:
+            producer_thread = threading.Thread(target=self.produce, args=(produce_batches, stage_metrics),
+                                               name=self.stage_name + " producer")
+            producer_thread.daemon = True
+            producer_thread.start()
+            try:
+                while True:
+                    item_kind, item = self.get()
+                    if item_kind == "end":
+                        break
+                    if item_kind == "error":
+                        raise item[0], item[1], item[2]
+                    consume_batch(item)
+                    self.batch_count += 1
+            finally:
+                self.stop_event.set()
+                producer_thread.join()
+            stage_metrics.update(self.get_statistics())
+        self.print_statistics()
+
+    # The rows the producer reads are counted in the stage of the pipeline only, not in the stages the consumer
+    # opens meanwhile
+    def produce(self, produce_batches, stage_metrics):
+        METRICS.join_stages([stage_metrics])
+        try:
+            batches = produce_batches()
+            try:
+                for batch in batches:
+                    if not self.put(("batch", batch)):
+                        return
+            finally:
+                batches.close()
+            self.put(("end", None))
+        except BaseException:
+            # KeyboardInterrupt or SystemExit included, or the consumer would wait forever on the queue
+            self.put(("error", sys.exc_info()))
+
+    # Returns False without putting the item if the consumer stopped
+    def put(self, item):
+        start_time = time.time()
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    self.batch_queue.put(item, timeout=PIPELINE_QUEUE_POLL_SECONDS)
+                    return True
+                except Queue.Full:
+                    continue
+            return False
+        finally:
+            self.producer_stall_seconds += time.time() - start_time
+
+    def get(self):
+        self.queue_depths.append(self.batch_queue.qsize())
+        start_time = time.time()
+        try:
+            return self.batch_queue.get()
+        finally:
+            self.consumer_stall_seconds += time.time() - start_time
+
+    def get_statistics(self):
+        return OrderedDict([
+            ("batches", self.batch_count),
+            ("queue_size", self.batch_queue.maxsize),
+            ("queue_max_depth", max(self.queue_depths) if self.queue_depths else 0),
+            ("queue_mean_depth", float(sum(self.queue_depths)) / len(self.queue_depths) if self.queue_depths else 0.0),
+            ("producer_stall_seconds", self.producer_stall_seconds),
+            ("consumer_stall_seconds", self.consumer_stall_seconds)
+        ])
+
+    def print_statistics(self):
+        statistics = self.get_statistics()
+        # The side that waits the least on the other is the one holding the pipeline back
+        bottleneck = "reader" if self.consumer_stall_seconds > self.producer_stall_seconds else "writer"
+        print_success("%s: %d batches, queue depth %.1f on average and %d at most out of %d, the reader waited "
+                      "%.3fs on a full queue and the writer %.3fs on an empty queue, the %s is the bottleneck" % (
+                          self.stage_name, statistics["batches"], statistics["queue_mean_depth"],
+                          statistics["queue_max_depth"], statistics["queue_size"], self.producer_stall_seconds,
+                          self.consumer_stall_seconds, bottleneck))
+
+
+# Builds the dimensions and the fact table reading the source STREAMING_CHUNK_SIZE rows at a time, for sources
+# too large for memory. The dimension key maps are HashedKeyMaps sized from memory_limit_mb, the fact rows
+# and load state of every chunk are loaded before the next chunk is loaded. With pipelined, the chunks are read
+# and normalized by a BatchPipeline reader thread while the previous chunks are loaded, up to PIPELINE_QUEUE_SIZE
+# chunks more are held in memory
+def stream_dimensions_and_fact_table(csv_file_location, memory_limit_mb, partition_years=None,
+                                     hash_surrogate_keys=False, pipelined=False):
+    dimension_names = ("summary", "disaster", "cost", "location")
+    max_memory_entries = memory_limit_mb * 1024 * 1024 // 2 // KEY_MAP_ENTRY_BYTES // len(dimension_names)
+    tuple_to_id_maps = dict([(dimension_name, HashedKeyMap(max_memory_entries)) for dimension_name in dimension_names])
+    member_tuple_attributes = {"summary": "summary_tuple", "disaster": "disaster_tuple", "cost": "cost_tuple",
+                               "location": "city_province_country_tuple"}
+    create_fact_table(partition_years)
+    create_load_state_table()
+    date_key_resolver = DateKeyResolver(load_date_dimension_keys())
+    loaded_facts_counts = []
+    try:
+        with open(PROBLEMATIC_ROW_FILE_LOCATION, "wb") as problematic_csv_file, \
+                open(PROBLEMATIC_PLACES_FILE_LOCATION, "wb") as problematic_places_file:
+            csv_writer = csv.writer(problematic_csv_file)
+            problematic_places_csv_writer = csv.writer(problematic_places_file)
+            problematic_places_csv_writer.writerow(("PLACE",))
+
+            def load_chunk(disaster_records):
+                write_problematic_place_rows(problematic_places_csv_writer, disaster_records)
+                for dimension_name in dimension_names:
+                    with METRICS.stage(dimension_name.capitalize() + " dimension"):
+                        get_dimension_populate_function(dimension_name, hash_surrogate_keys)(
+                            [getattr(disaster_record, member_tuple_attributes[dimension_name])
+                             for disaster_record in disaster_records], tuple_to_id_maps[dimension_name])
+                with METRICS.stage("Fact table"):
+                    resolved_disaster_records, fact_tuples = get_fact_tuples(
+                        disaster_records, csv_writer, tuple_to_id_maps["location"], tuple_to_id_maps["cost"],
+                        tuple_to_id_maps["disaster"], tuple_to_id_maps["summary"], date_key_resolver)
+                    loaded_facts = load_fact_tuples(resolved_disaster_records, fact_tuples, csv_writer,
+                                                    partition_years)
+                    copy_rows_into_table(LOAD_STATE_TABLE_NAME, LOAD_STATE_COLUMN_NAMES,
+                                         get_load_state_rows(loaded_facts))
+                loaded_facts_counts.append(len(loaded_facts))
+                current_rss_kb = get_current_rss_kb()
+                if current_rss_kb is not None and current_rss_kb > memory_limit_mb * 1024:
+                    log("Memory limit reached, moving the dimension key maps to disk")
+                    for tuple_to_id_map in tuple_to_id_maps.values():
+                        tuple_to_id_map.spill()
+
+            if pipelined:
+                BatchPipeline("Pipelined load").run(
+                    lambda: read_disaster_record_chunks(csv_file_location, STREAMING_CHUNK_SIZE), load_chunk)
+            else:
+                for disaster_records in read_disaster_record_chunks(csv_file_location, STREAMING_CHUNK_SIZE):
+                    load_chunk(disaster_records)
+        print_success("Streamed %d fact rows, peak memory %s kB for a limit of %d MB, "
+                      "%d dimension keys moved to disk" % (
+                          sum(loaded_facts_counts), get_peak_rss_kb(), memory_limit_mb,
+                          sum([tuple_to_id_map.spilled_entry_count for tuple_to_id_map in tuple_to_id_maps.values()])))
+    finally:
+        for tuple_to_id_map in tuple_to_id_maps.values():
+            tuple_to_id_map.close()
+
+
+def create_data_mart(incremental=False, workers=1, explain_scripts=False, partition_years=None, streaming=False,
+                     memory_limit_mb=STREAMING_MEMORY_LIMIT_MB, hash_surrogate_keys=HASH_SURROGATE_KEYS_TURNED_ON,
+                     pipelined=False):
     log("Starting creation of data mart")
+    if incremental:
+        if data_mart_exists():
+            with timed_stage("Read source"):
+                disaster_records = read_disaster_records(CSV_FILE_LOCATION)
+            update_data_mart(disaster_records, workers, explain_scripts)
+            bump_data_version()
+            return
+        print_success("No previous load found, running a full load")
+    # The date dimension is sized to the dates of the source, so the source is read first
+    if streaming or pipelined:
+        with timed_stage("Read source dates"):
+            first_date, last_date = get_source_date_range(read_source_date_strings(CSV_FILE_LOCATION))
+    else:
+        # The source csv is read and normalized only once, every dimension and the fact table are built from its records
+        with timed_stage("Read source"):
+            disaster_records = read_disaster_records(CSV_FILE_LOCATION)
+        first_date, last_date = get_source_date_range(get_record_date_strings(disaster_records))
     # Start calling create_populate methods here
-    create_populate_date_dimension()
-    summary_tuple_to_id_map = create_populate_summary_dimension()
-    disaster_tuple_to_id_map = create_populate_disaster_dimension()
-    cost_tuple_to_id_map = create_populate_cost_dimension()
-    city_province_tuple_to_id_map = create_populate_location_dimension()
-    create_populate_fact_table(city_province_tuple_to_id_map, cost_tuple_to_id_map, disaster_tuple_to_id_map, summary_tuple_to_id_map)
-
-
-create_data_mart()
-# Connection must be closed after everything is said and done, do add or remove anything past this point
-CONNECTION.close()
-log('Connection closed')
+    with timed_stage("Date dimension"):
+        create_populate_date_dimension(first_date, last_date)
+    with timed_stage("Population dimension"):
+        create_populate_population_dimension()
+    create_summary_dimension(hash_surrogate_keys)
+    create_disaster_dimension(hash_surrogate_keys)
+    create_cost_dimension(hash_surrogate_keys)
+    create_location_dimension(hash_surrogate_keys)
+    if streaming or pipelined:
+        with timed_stage("Streaming load"):
+            stream_dimensions_and_fact_table(CSV_FILE_LOCATION, memory_limit_mb, partition_years, hash_surrogate_keys,
+                                             pipelined)
+    else:
+        tuple_to_id_maps = populate_dimensions(disaster_records, {}, workers, hash_surrogate_keys)
+        with timed_stage("Fact table"):
+            create_populate_fact_table(disaster_records, tuple_to_id_maps["location"], tuple_to_id_maps["cost"],
+                                       tuple_to_id_maps["disaster"], tuple_to_id_maps["summary"], partition_years)
+    with timed_stage("Aggregate tables"):
+        create_aggregate_tables()
+        refresh_aggregate_tables()
+    build_indexes_and_statistics(explain_scripts)
+    bump_data_version()
+
+
+# Tables of the export in the order of their columns, with the fact column joining each dimension
+EXPORT_TABLES = (
+    ("fact", None),
+    ("location_dimension", "location_key"),
+    ("cost_dimension", "cost_key"),
+    ("date_dimension", "start_date_key"),
+    ("disaster_dimension", "disaster_key"),
+    ("summary_dimension", "summary_key")
+)
+# Free text columns, written as ARFF string attributes since their domain would be as large as the fact table
+EXPORT_STRING_COLUMN_NAMES = ("summary",)
+EXPORT_NUMERIC_DATA_TYPES = ("smallint", "integer", "bigint", "numeric", "real", "double precision")
+ARFF_SPECIAL_CHARACTER_PATTERN = re.compile(r"[\s,'\"{}%\\]")
+
+
+# Returns the (name, PostgreSQL data type) pairs of the columns of a table of the schema, in their order
+def get_table_columns(table_name):
+    return [(row[0], row[1]) for row in execute_query("""
+        SELECT  column_name, data_type
+        FROM    information_schema.columns
+        WHERE   table_schema = 'disaster_db_schema' AND table_name = %s
+        ORDER BY ordinal_position;
+    """, (table_name,))]
+
+
+# Returns the select expression, name and data type of every exported column: the fact columns followed by the
+# attributes of the dimensions, without their keys
+def get_export_columns():
+    export_columns = []
+    for table_name, fact_key_column_name in EXPORT_TABLES:
+        for column_name, data_type in get_table_columns(table_name):
+            if fact_key_column_name is None or not column_name.endswith("_key"):
+                export_columns.append(("%s.%s" % (table_name, column_name), column_name, data_type))
+    return export_columns
+
+
+def get_export_query(export_columns):
+    join_clauses = ["LEFT JOIN disaster_db.disaster_db_schema.%s %s ON %s.%s = fact.%s" % (
+        table_name, table_name, table_name, "date_key" if table_name == "date_dimension" else fact_key_column_name,
+        fact_key_column_name) for table_name, fact_key_column_name in EXPORT_TABLES[1:]]
+    return """
+        SELECT  %s
+        FROM    disaster_db.disaster_db_schema.fact fact
+        %s
+        ORDER BY fact.start_date_key, fact.end_date_key, fact.location_key, fact.disaster_key, fact.summary_key;
+    """ % (", ".join([select_expression for select_expression, _, _ in export_columns]),
+           "\n        ".join(join_clauses))
+
+
+def get_arff_attribute_kind(column_name, data_type):
+    if data_type in EXPORT_NUMERIC_DATA_TYPES:
+        return "numeric"
+    if data_type == "date":
+        return "date"
+    if column_name in EXPORT_STRING_COLUMN_NAMES:
+        return "string"
+    return "nominal"
+
+
+def to_arff_value(value):
+    if value is None:
+        return "?"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, (int, long, float, Decimal)):
+        return str(value)
+    if value == "" or value == "?" or ARFF_SPECIAL_CHARACTER_PATTERN.search(value):
+        return "'%s'" % value.replace("\\", "\\\\").replace("'", "\\'").replace("\n", "\\n").replace(
+            "\r", "\\r").replace("\t", "\\t")
+    return value
+
+
+def get_arff_attribute_type(attribute_kind, nominal_values):
+    if attribute_kind == "nominal":
+        return "{%s}" % ",".join(nominal_values)
+    if attribute_kind == "date":
+        return 'date "yyyy-MM-dd"'
+    return attribute_kind
+
+
+# pyarrow is only imported by the Parquet export, importing it (and NumPy) would slow down every import of this module
+def get_parquet_type(data_type):
+    import pyarrow
+    if data_type in ("smallint", "integer", "bigint"):
+        return pyarrow.int64()
+    if data_type in EXPORT_NUMERIC_DATA_TYPES:
+        return pyarrow.float64()
+    if data_type == "date":
+        return pyarrow.date32()
+    if data_type == "boolean":
+        return pyarrow.bool_()
+    return pyarrow.string()
+
+
+# Writes a batch of joined fact rows as a row group of the Parquet file
+def write_parquet_batch(parquet_writer, parquet_schema, rows):
+    import pyarrow
+    arrays = []
+    for column_index, field in enumerate(parquet_schema):
+        values = [row[column_index] for row in rows]
+        if field.type == pyarrow.float64():
+            values = [float(value) if value is not None else None for value in values]
+        arrays.append(pyarrow.array(values, type=field.type))
+    parquet_writer.write_table(pyarrow.Table.from_arrays(arrays, schema=parquet_schema))
+
+
+# Writes the fact table joined to all its dimensions to an ARFF file and, when pyarrow is installed, a Parquet file.
+# The rows are streamed with stream_query and handled EXPORT_BATCH_SIZE at a time, so the memory used doesn't grow
+# with the fact table. The ARFF data section is written to a temporary file while the domains of the nominal attributes are
+# collected, then copied after the header once the domains are known
+def export_data_mart(arff_file_location=ARFF_EXPORT_FILE_LOCATION,
+                     parquet_file_location=PARQUET_EXPORT_FILE_LOCATION):
+    export_columns = get_export_columns()
+    attribute_kinds = [get_arff_attribute_kind(column_name, data_type) for _, column_name, data_type in export_columns]
+    nominal_values = [OrderedDict() for _ in export_columns]
+    parquet_writer = None
+    parquet_schema = None
+    if parquet_file_location is not None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            # Only needed for the Parquet export, the ARFF export works without it
+            pyarrow = None
+        if pyarrow is None:
+            print_success("pyarrow is not installed, skipping the Parquet export")
+        else:
+            parquet_schema = pyarrow.schema([pyarrow.field(column_name, get_parquet_type(data_type))
+                                             for _, column_name, data_type in export_columns])
+            parquet_writer = pyarrow.parquet.ParquetWriter(parquet_file_location, parquet_schema)
+    exported_rows_count = 0
+    try:
+        with tempfile.TemporaryFile() as arff_data_file:
+            joined_fact_rows = stream_query(get_export_query(export_columns), itersize=EXPORT_BATCH_SIZE)
+            while True:
+                rows = list(itertools.islice(joined_fact_rows, EXPORT_BATCH_SIZE))
+                if not rows:
+                    break
+                for row in rows:
+                    arff_values = [to_arff_value(value) for value in row]
+                    for column_index, attribute_kind in enumerate(attribute_kinds):
+                        if attribute_kind == "nominal" and row[column_index] is not None:
+                            nominal_values[column_index][arff_values[column_index]] = True
+                    arff_data_file.write(",".join(arff_values) + "\n")
+                if parquet_writer is not None:
+                    write_parquet_batch(parquet_writer, parquet_schema, rows)
+                exported_rows_count += len(rows)
+            with open(arff_file_location, "wb") as arff_file:
+                arff_file.write("@relation %s\n\n" % ARFF_RELATION_NAME)
+                for (_, column_name, _), attribute_kind, values in zip(export_columns, attribute_kinds, nominal_values):
+                    arff_file.write("@attribute %s %s\n" % (column_name,
+                                                             get_arff_attribute_type(attribute_kind, values.keys())))
+                arff_file.write("\n@data\n")
+                arff_data_file.seek(0)
+                shutil.copyfileobj(arff_data_file, arff_file)
+    finally:
+        if parquet_writer is not None:
+            parquet_writer.close()
+    print_success("Exported %d fact rows to %s%s" % (exported_rows_count, arff_file_location,
+                                                     " and " + parquet_file_location if parquet_writer else ""))
+
+
+def parse_arguments():
+    argument_parser = argparse.ArgumentParser(description="Creates the disaster data mart from " + CSV_FILE_LOCATION)
+    argument_parser.add_argument("--incremental", action="store_true",
+                                 help="only load the rows that are new or amended since the last load instead of "
+                                      "dropping and recreating every table")
+    argument_parser.add_argument("--workers", type=int, default=1,
+                                 help="number of worker processes building the summary, disaster, cost and location "
+                                      "dimensions in parallel, 1 builds them one after the other")
+    argument_parser.add_argument("--partitioned", action="store_true", default=FACT_PARTITIONING_TURNED_ON,
+                                 help="create the fact table partitioned by ranges of event start dates")
+    argument_parser.add_argument("--partition-years", type=int, default=FACT_PARTITION_YEARS,
+                                 help="number of years of event start dates in each partition of the fact table")
+    argument_parser.add_argument("--hash-keys", action="store_true", default=HASH_SURROGATE_KEYS_TURNED_ON,
+                                 help="derive the dimension keys from a hash of their attributes instead of SERIAL "
+                                      "values, incremental loads keep the keys of the existing data mart")
+    argument_parser.add_argument("--dimension-batch-size", type=int, default=DIMENSION_INSERT_BATCH_SIZE,
+                                 help="number of new dimension members sent in each INSERT statement")
+    argument_parser.add_argument("--streaming", action="store_true",
+                                 help="for sources too large for memory: read and load the source in chunks with "
+                                      "dimension key maps moved to disk past --memory-limit-mb, full loads only")
+    argument_parser.add_argument("--pipelined", action="store_true",
+                                 help="load the source in chunks like --streaming, reading and normalizing the next "
+                                      "chunks in a thread while the current one is loaded, full loads only")
+    argument_parser.add_argument("--memory-limit-mb", type=int, default=STREAMING_MEMORY_LIMIT_MB,
+                                 help="memory the streaming load tries to stay under")
+    argument_parser.add_argument("--explain", action="store_true",
+                                 help="print the plan of every analytic script of " + SQL_SCRIPTS_DIRECTORY +
+                                      " before and after the indexes are built")
+    argument_parser.add_argument("--holiday-provinces", nargs="+", choices=sorted(holidays.Canada.PROVINCES),
+                                 help="add the provincial holidays of these Canadian provinces to the date dimension "
+                                      "instead of only those of Ontario")
+    argument_parser.add_argument("--export", action="store_true",
+                                 help="once loaded, export the fact table joined to its dimensions to --arff-file "
+                                      "and, if pyarrow is installed, --parquet-file")
+    argument_parser.add_argument("--arff-file", default=ARFF_EXPORT_FILE_LOCATION,
+                                 help="ARFF file written by --export")
+    argument_parser.add_argument("--parquet-file", default=PARQUET_EXPORT_FILE_LOCATION,
+                                 help="Parquet file written by --export")
+    argument_parser.add_argument("--metrics-file", default=METRICS_FILE_LOCATION,
+                                 help="JSON file the counts, times and peak memory of every stage are written to")
+    argument_parser.add_argument("--prometheus-file", default=PROMETHEUS_METRICS_FILE_LOCATION,
+                                 help="also write the metrics to this file in the Prometheus text format")
+    return argument_parser.parse_args()
+
+
+def write_metrics(metrics_file_location, prometheus_metrics_file_location):
+    METRICS.write_json(metrics_file_location)
+    if prometheus_metrics_file_location is not None:
+        METRICS.write_prometheus(prometheus_metrics_file_location)
+    print_success("Metrics written to " + metrics_file_location)
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    DIMENSION_INSERT_BATCH_SIZE = arguments.dimension_batch_size
+    HOLIDAY_PROVINCES = arguments.holiday_provinces
+    create_data_mart(incremental=arguments.incremental, workers=arguments.workers, explain_scripts=arguments.explain,
+                     partition_years=arguments.partition_years if arguments.partitioned else None,
+                     streaming=arguments.streaming, memory_limit_mb=arguments.memory_limit_mb,
+                     hash_surrogate_keys=arguments.hash_keys, pipelined=arguments.pipelined)
+    if arguments.export:
+        with timed_stage("Export"):
+            export_data_mart(arguments.arff_file, arguments.parquet_file)
+    write_metrics(arguments.metrics_file, arguments.prometheus_file)
+    # Connection must be closed after everything is said and done, do add or remove anything past this point
+    close_connections()
+    log('Connection closed')
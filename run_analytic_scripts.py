@@ -0,0 +1,148 @@
+# coding=utf-8
+# Runs every analytic script of sql_scripts concurrently, each on its own connection of the pool, and prints the
+# latency of every script, slowest first. The result of each script is cached as JSON and CSV under a key made of
+# the hash of the script and the data version the loader bumps after every load: an unchanged script run against
+# unchanged data is answered from the cache without querying the database. Run it from the root of the repository:
+#     python run_analytic_scripts.py --workers 3
+import argparse
+import csv
+import hashlib
+import json
+import os
+import time
+from decimal import Decimal
+from multiprocessing.pool import ThreadPool
+
+import db_data_formatter
+
+QUERY_CACHE_DIRECTORY = ".query_cache"
+
+
+def get_cache_key(script_content, data_version):
+    return hashlib.sha1(script_content + "\x1f" + data_version).hexdigest()
+
+
+def get_cache_file_prefix(cache_directory, script_location):
+    return os.path.join(cache_directory, os.path.splitext(os.path.basename(script_location))[0])
+
+
+def to_json_value(value):
+    # Decimals are kept as text so no precision is lost
+    if isinstance(value, Decimal):
+        return str(value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+def read_cached_result(cache_file_prefix, cache_key):
+    try:
+        with open("%s.%s.json" % (cache_file_prefix, cache_key), "r") as cache_file:
+            return json.load(cache_file)
+    except IOError:
+        return None
+
+
+# Writes the result of a script to the cache and removes the results cached for its previous versions or data
+def write_cached_result(cache_file_prefix, cache_key, result):
+    cache_directory = os.path.dirname(cache_file_prefix)
+    for file_name in os.listdir(cache_directory):
+        if file_name.startswith(os.path.basename(cache_file_prefix) + ".") and cache_key not in file_name:
+            os.remove(os.path.join(cache_directory, file_name))
+    with open("%s.%s.json" % (cache_file_prefix, cache_key), "w") as cache_file:
+        json.dump(result, cache_file, indent=2)
+    with open("%s.%s.csv" % (cache_file_prefix, cache_key), "wb") as cache_file:
+        csv_writer = csv.writer(cache_file)
+        csv_writer.writerow(result["columns"])
+        for row in result["rows"]:
+            csv_writer.writerow([value.encode("utf-8") if isinstance(value, unicode) else value for value in row])
+
+
+# Runs the statements of a script on a connection of the pool. The rows of its last statement are returned,
+# the statements before it (SET SEARCH_PATH) only last until the connection is rolled back
+def query_script(script_content):
+    with db_data_formatter.pooled_connection() as connection:
+        cursor = connection.cursor()
+        try:
+            cursor.execute(script_content)
+            if cursor.description is None:
+                return [], []
+            return [column.name for column in cursor.description], \
+                [[to_json_value(value) for value in row] for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+
+# Returns the result of a script, from the cache when it holds one for the script and the data version
+def run_script(script_location, data_version, cache_directory):
+    start_time = time.time()
+    with open(script_location, "r") as script_file:
+        script_content = script_file.read()
+    cache_file_prefix = cache_key = None
+    if cache_directory is not None and data_version is not None:
+        cache_file_prefix = get_cache_file_prefix(cache_directory, script_location)
+        cache_key = get_cache_key(script_content, data_version)
+        result = read_cached_result(cache_file_prefix, cache_key)
+        if result is not None:
+            return script_location, result, True, time.time() - start_time
+    columns, rows = query_script(script_content)
+    result = {"script": script_location, "data_version": data_version, "columns": columns, "rows": rows}
+    if cache_file_prefix is not None:
+        write_cached_result(cache_file_prefix, cache_key, result)
+    return script_location, result, False, time.time() - start_time
+
+
+def run_scripts(workers, cache_directory):
+    # The data version is read on the shared connection, which also opens the pool before the threads use it
+    data_version = db_data_formatter.get_data_version()
+    if data_version is None:
+        print "No data version found, load the data mart first to cache the results"
+    if cache_directory is not None and not os.path.isdir(cache_directory):
+        os.makedirs(cache_directory)
+    script_locations = db_data_formatter.get_analytic_script_locations()
+    thread_pool = ThreadPool(workers)
+    try:
+        script_results = thread_pool.map(lambda script_location: run_script(script_location, data_version,
+                                                                             cache_directory), script_locations)
+    finally:
+        thread_pool.close()
+        thread_pool.join()
+    return data_version, script_results
+
+
+def print_report(data_version, script_results, elapsed_seconds):
+    print "Data version %s" % data_version
+    for script_location, result, from_cache, script_seconds in sorted(script_results, key=lambda script_result:
+                                                                      script_result[3], reverse=True):
+        print "%9.3fms %-6s %5d rows  %s" % (script_seconds * 1000, "cache" if from_cache else "query",
+                                            len(result["rows"]), script_location)
+    print "Ran %d scripts in %.3fs" % (len(script_results), elapsed_seconds)
+
+
+def parse_arguments():
+    argument_parser = argparse.ArgumentParser(description="Runs the analytic scripts of " +
+                                                          db_data_formatter.SQL_SCRIPTS_DIRECTORY +
+                                                          " concurrently and caches their results")
+    # One connection of the pool is kept for the shared connection reading the data version
+    argument_parser.add_argument("--workers", type=int,
+                                 default=max(db_data_formatter.CONNECTION_POOL_MAX_SIZE - 1, 1),
+                                 help="number of scripts run at once, at most the connection pool size minus one")
+    argument_parser.add_argument("--cache-dir", default=QUERY_CACHE_DIRECTORY,
+                                 help="directory the results of the scripts are cached in")
+    argument_parser.add_argument("--no-cache", action="store_true",
+                                 help="query the database for every script and leave the cache as it is")
+    arguments = argument_parser.parse_args()
+    # More workers than the connections left in the pool would fail with PoolError: connection pool exhausted
+    max_workers = db_data_formatter.CONNECTION_POOL_MAX_SIZE - 1
+    if not 1 <= arguments.workers <= max_workers:
+        argument_parser.error("--workers must be between 1 and %d, the connection pool size minus one "
+                              "(DISASTER_DB_CONNECTION_POOL_MAX_SIZE)" % max_workers)
+    return arguments
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    start_time = time.time()
+    data_version, script_results = run_scripts(arguments.workers, None if arguments.no_cache else arguments.cache_dir)
+    print_report(data_version, script_results, time.time() - start_time)
+    db_data_formatter.close_connections()
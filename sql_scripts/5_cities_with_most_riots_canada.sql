@@ -1,10 +1,8 @@
 -- determine the 5 cities in Canada with the most riots
 SET SEARCH_PATH to 'disaster_db_schema';
-SELECT city, count(*) as number_of_riots
-FROM fact
-INNER JOIN location_dimension ld ON fact.location_key = ld.location_key
-INNER JOIN disaster_dimension d3 ON fact.disaster_key = d3.disaster_key
+SELECT city, SUM(event_count) as number_of_riots
+FROM city_disaster_aggregate
 WHERE disaster_type = 'rioting' AND country = 'CANADA'
 GROUP BY city
-ORDER BY count(*) DESC
+ORDER BY SUM(event_count) DESC
 LIMIT 5;
\ No newline at end of file
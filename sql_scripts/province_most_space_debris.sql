@@ -1,10 +1,8 @@
 -- determine the province in Canada with the most space debris
 SET SEARCH_PATH to 'disaster_db_schema';
-SELECT province, count(*) as number_of_space_debris_disasters
-FROM fact
-  INNER JOIN location_dimension ld ON fact.location_key = ld.location_key
-  INNER JOIN disaster_dimension d3 ON fact.disaster_key = d3.disaster_key
+SELECT province, SUM(event_count) as number_of_space_debris_disasters
+FROM disaster_aggregate
 WHERE disaster_type = 'space debris' AND country = 'CANADA'
 GROUP BY province
-ORDER BY count(*) DESC
+ORDER BY SUM(event_count) DESC
 LIMIT 1;
\ No newline at end of file